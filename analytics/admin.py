@@ -1,4 +1,28 @@
 from django.contrib import admin
-from .models import BlogView
 
-admin.site.register(BlogView)
+from main.paginators import EstimatedCountPaginator
+from .models import BlogView, BlogViewDaily
+
+
+class BlogViewAdmin(admin.ModelAdmin):
+    list_display = ('id', 'blog', 'ip_address', 'viewer_country', 'created_at')
+    list_select_related = ('blog', 'blog__author', 'viewer_country')  # BlogView.__str__ / the blog column render blog and its author
+    list_filter = (('created_at', admin.DateFieldListFilter),)  # created_at__gte/__lt ranges on the created_at index
+    raw_id_fields = ('blog', 'viewer_country')
+    ordering = ('-created_at', '-id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class BlogViewDailyAdmin(admin.ModelAdmin):
+    list_display = ('blog', 'day', 'viewer_country', 'views')
+    list_select_related = ('blog', 'blog__author', 'viewer_country')
+    list_filter = (('day', admin.DateFieldListFilter),)
+    raw_id_fields = ('blog', 'viewer_country')
+    ordering = ('-day', 'blog')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+admin.site.register(BlogView, BlogViewAdmin)
+admin.site.register(BlogViewDaily, BlogViewDailyAdmin)
@@ -0,0 +1,102 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, OperationalError, connections, transaction
+
+QUERY_CANCELED = "57014"  # Postgres SQLSTATE of a statement cancelled by statement_timeout
+
+# monotonic deadline of the innermost time_budget() block, for the work it hands to other threads (see scatter())
+_deadline = ContextVar("time_budget_deadline", default=None)
+
+
+class BudgetExceeded(DatabaseError):
+    """The queries of a time_budget() block ran longer than the budget and were interrupted."""
+
+
+def endpoint_budget(endpoint):
+    # Seconds /analytics/<name>/ may spend on the database: ANALYTICS_TIME_BUDGETS[name] or ANALYTICS_TIME_BUDGET
+    name = endpoint.strip("/").split("/")[-1]
+    return settings.ANALYTICS_TIME_BUDGETS.get(name, settings.ANALYTICS_TIME_BUDGET)
+
+
+def _is_timeout(connection, error):
+    if connection.vendor == "sqlite":
+        return "interrupted" in str(error)
+    cause = error.__cause__
+    return (getattr(cause, "sqlstate", None) or getattr(cause, "pgcode", None)) == QUERY_CANCELED
+
+
+def remaining_budget():
+    # Seconds left to the time_budget() block the caller runs in, None outside of one
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+@contextmanager
+def time_budget(seconds, using=DEFAULT_DB_ALIAS):
+    """
+    Interrupt the queries run inside the block on the `using` database once they have taken `seconds` in total and
+    raise BudgetExceeded from it. Postgres cancels the running statement with statement_timeout (and no new statement
+    starts after the deadline), SQLite interrupts it from a progress handler. A falsy budget or another database: no
+    limit.
+    """
+    connection = connections[using]
+    if not seconds or connection.vendor not in ("postgresql", "sqlite"):
+        yield
+        return
+
+    deadline = time.monotonic() + seconds
+    token = _deadline.set(deadline)
+    try:
+        if connection.vendor == "postgresql":
+            def check_deadline(execute, sql, params, many, context):
+                if time.monotonic() >= deadline:
+                    raise BudgetExceeded(f"Time budget of {seconds}s exceeded")
+                return execute(sql, params, many, context)
+
+            with transaction.atomic(using=using), connection.execute_wrapper(check_deadline):
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SET LOCAL statement_timeout = {int(seconds * 1000)}")
+                yield
+        else:
+            connection.ensure_connection()
+            # called every 10k SQLite VM instructions, a non-zero return aborts the statement
+            connection.connection.set_progress_handler(lambda: time.monotonic() >= deadline, 10_000)
+            try:
+                yield
+            finally:
+                connection.connection.set_progress_handler(None, 0)
+    except OperationalError as e:
+        if _is_timeout(connection, e):
+            raise BudgetExceeded(f"Time budget of {seconds}s exceeded") from e
+        raise
+    finally:
+        _deadline.reset(token)
+
+
+def count_budget_hit(endpoint):
+    # Per endpoint counter of the requests that ran out of time, in the default cache
+    key = f"analytics:budget_hits:{endpoint}"
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key)
+    except ValueError:  # evicted in between
+        cache.set(key, 1, None)
+        return 1
+
+
+def budget_hits(endpoints):
+    return {endpoint: cache.get(f"analytics:budget_hits:{endpoint}", 0) for endpoint in endpoints}
+
+
+def sample_windows(start_date, end_date, one_in, slices=20):
+    """
+    Evenly spread windows covering 1/`one_in` of [start_date, end_date]: the range is cut into `one_in` * `slices`
+    equal parts and every `one_in`-th one is kept. Counting the views of these windows and multiplying by
+    `one_in` estimates the views of the whole range from 1/`one_in` of the index entries.
+    """
+    step = (end_date - start_date) / (one_in * slices)
+    return [(start_date + step * i, start_date + step * (i + 1)) for i in range(one_in // 2, one_in * slices, one_in)]
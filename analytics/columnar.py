@@ -0,0 +1,441 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max, Min
+
+from analytics.models import BlogView, BlogViewDaily
+from analytics.retention import compacted_until
+from analytics.sharding import sharding_enabled
+from blogs.models import Blog
+
+logger = logging.getLogger("django")
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+ONE_US = timedelta(microseconds=1)
+BATCH_SIZE = 200_000
+CHECKPOINT_ROWS = 4_000_000  # rows between the cumulative per blog counts of the main segment
+
+# Start of the period a UTC datetime falls in and the step to the next one, same periods as TruncDay/Week/Month/Year
+PERIOD_STARTS = {
+    "day": lambda dt: dt.replace(hour=0, minute=0, second=0, microsecond=0),
+    "week": lambda dt: dt.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=dt.weekday()),
+    "month": lambda dt: dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0),
+    "year": lambda dt: dt.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0),
+}
+PERIOD_STEPS = {"day": relativedelta(days=1), "week": relativedelta(weeks=1), "month": relativedelta(months=1), "year": relativedelta(years=1)}
+
+
+def columnar_enabled():
+    return settings.ANALYTICS_COLUMNAR and not sharding_enabled()
+
+
+def columnar_ready():
+    # Enabled and loaded: until the first (background) load is done, requests are answered by the database
+    return columnar_enabled() and columnar_engine.columns() is not None
+
+
+def to_us(value):
+    # Epoch microseconds of an aware datetime, or of the (UTC) midnight starting a date
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day, tzinfo=dt_timezone.utc)
+    return (value - EPOCH) // ONE_US
+
+
+def _intern(values):
+    # (codes, names): names sorted with None last, so ordering by code is ordering by name
+    names = sorted(set(values), key=lambda name: (name is None, name))
+    index = {name: i for i, name in enumerate(names)}
+    return np.fromiter((index[value] for value in values), dtype=np.int32, count=len(values)), names
+
+
+class BlogMap:
+    """
+    Blog ids (sorted) and, per blog index, the index of its author's username and country name. Views refer to
+    their blog by index, an int32 instead of the id.
+    """
+
+    def __init__(self):
+        rows = list(Blog.objects.order_by("id").values_list("id", "author__username", "author__country__name"))
+        self.ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        self.last_id = int(self.ids[-1]) if len(rows) else 0
+        users, user_names = _intern([row[1] for row in rows])
+        countries, country_names = _intern([row[2] for row in rows])
+        # group field of the endpoints: (code of every blog, value of every code)
+        self.groups = {
+            "author__username": (users, user_names),
+            "author__country__name": (countries, country_names),
+            "id": (np.arange(len(rows), dtype=np.int32), self.ids.tolist()),
+        }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def index(self, blog_ids):
+        # (index of every id, whether the id is known)
+        if not len(self.ids):
+            return np.zeros(len(blog_ids), dtype=np.int32), np.zeros(len(blog_ids), dtype=bool)
+        index = np.minimum(np.searchsorted(self.ids, blog_ids), len(self.ids) - 1)
+        return index.astype(np.int32), self.ids[index] == blog_ids
+
+    def mask(self, blog_ids):
+        # Boolean mask over the blog indexes of an iterable of ids, None (every blog) when blog_ids is None
+        if blog_ids is None:
+            return None
+        ids = np.fromiter(blog_ids, dtype=np.int64)
+        index, known = self.index(ids)
+        mask = np.zeros(len(self.ids), dtype=bool)
+        mask[index[known]] = True
+        return mask
+
+
+class Segment:
+    """
+    Views sorted by time: created_at in epoch microseconds, blog index and, for compacted days, the views of the row.
+    The main segment also keeps the per blog counts of the rows before every CHECKPOINT_ROWS-th one, so the counts
+    of a long window are the difference of two checkpoints plus the rows at both ends.
+    """
+
+    def __init__(self, times, blogs, views=None, checkpoints=None):
+        self.times, self.blogs, self.views, self.checkpoints = times, blogs, views, checkpoints
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32))
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def nbytes(self):
+        arrays = [self.times, self.blogs, self.views, self.checkpoints]
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def window(self, start_us, end_us):
+        # (first, last + 1) position of the rows in [start_us, end_us]
+        return int(np.searchsorted(self.times, start_us, "left")), int(np.searchsorted(self.times, end_us, "right"))
+
+    def counts(self, first, last, n_blogs):
+        # Rows (views of the compacted days) of every blog index in [first, last)
+        if self.views is not None:
+            return np.bincount(self.blogs[first:last], weights=self.views[first:last], minlength=n_blogs).astype(np.int64)
+        start, end = -(-first // CHECKPOINT_ROWS), last // CHECKPOINT_ROWS
+        if self.checkpoints is None or end - start < 2:
+            return np.bincount(self.blogs[first:last], minlength=n_blogs)
+        counts = np.zeros(n_blogs, dtype=np.int64)
+        counts[:self.checkpoints.shape[1]] = self.checkpoints[end] - self.checkpoints[start]
+        counts += np.bincount(self.blogs[first:start * CHECKPOINT_ROWS], minlength=n_blogs)
+        counts += np.bincount(self.blogs[end * CHECKPOINT_ROWS:last], minlength=n_blogs)
+        return counts
+
+    def with_checkpoints(self, n_blogs, previous=None, unchanged=0):
+        # Same rows with their checkpoints, the ones of `previous` before row `unchanged` (same rows up to it) reused
+        kept = 0 if previous is None or previous.checkpoints is None else min(unchanged // CHECKPOINT_ROWS, len(previous.checkpoints) - 1)
+        checkpoints = np.zeros((len(self) // CHECKPOINT_ROWS + 1, n_blogs), dtype=np.int32)
+        if kept:
+            checkpoints[:kept + 1, :previous.checkpoints.shape[1]] = previous.checkpoints[:kept + 1]
+        for i in range(kept + 1, len(checkpoints)):
+            checkpoints[i] = checkpoints[i - 1] + np.bincount(self.blogs[(i - 1) * CHECKPOINT_ROWS:i * CHECKPOINT_ROWS], minlength=n_blogs)
+        return Segment(self.times, self.blogs, checkpoints=checkpoints)
+
+    def merge(self, other, n_blogs):
+        if not len(other):
+            return self
+        times = np.concatenate([self.times, other.times])
+        blogs = np.concatenate([self.blogs, other.blogs])
+        unchanged = len(self)
+        if len(self) and other.times[0] < self.times[-1]:
+            # two sorted runs, the stable sort (timsort) merges them in linear time
+            order = np.argsort(times, kind="stable")
+            times, blogs = times[order], blogs[order]
+            unchanged = int(np.searchsorted(self.times, other.times[0], "right"))
+        merged = Segment(times, blogs)
+        return merged.with_checkpoints(n_blogs, self, unchanged) if self.checkpoints is not None else merged
+
+
+class Columns:
+    # One consistent state of the engine, never modified: a refresh builds a new one and queries keep theirs
+    def __init__(self, blogs, main, delta, daily, last_id, signature):
+        self.blogs, self.main, self.delta, self.daily = blogs, main, delta, daily
+        self.last_id, self.signature = last_id, signature
+
+    @property
+    def segments(self):
+        return [self.main, self.delta]
+
+
+def _signature():
+    # Changes when raw views are compacted into BlogViewDaily (or otherwise deleted): only a full reload catches that
+    return compacted_until(), BlogView.objects.aggregate(first=Min("id"))["first"]
+
+
+def _read_views(blogs, after_id):
+    """
+    Segment of the views with an id above `after_id` and the last id read. Stops before the first view of a blog
+    missing from `blogs` (created after it was loaded), the next refresh reloads the blogs and reads it.
+    """
+    times, indexes = [], []
+    missing = False
+    while not missing:
+        rows = list(BlogView.objects.filter(id__gt=after_id).order_by("id").values_list("id", "blog_id", "created_at")[:BATCH_SIZE])
+        if not rows:
+            break
+        index, known = blogs.index(np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows)))
+        if not known.all():
+            missing = True
+            rows, index = rows[:int(np.argmin(known))], index[:int(np.argmin(known))]
+            if not rows:
+                break
+        times.append(np.fromiter(((row[2] - EPOCH) // ONE_US for row in rows), dtype=np.int64, count=len(rows)))
+        indexes.append(index)
+        after_id = rows[-1][0]
+        if len(rows) < BATCH_SIZE:
+            break
+
+    if not times:
+        return Segment.empty(), after_id, missing
+    times, indexes = np.concatenate(times), np.concatenate(indexes)
+    order = np.argsort(times, kind="stable")
+    return Segment(times[order], indexes[order]), after_id, missing
+
+
+def _read_daily(blogs):
+    rows = list(BlogViewDaily.objects.order_by("day").values_list("day", "blog_id", "views"))
+    index, known = blogs.index(np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows)))
+    times = np.fromiter((to_us(row[0]) for row in rows), dtype=np.int64, count=len(rows))
+    views = np.fromiter((row[2] for row in rows), dtype=np.int64, count=len(rows))
+    return Segment(times[known], index[known], views[known])
+
+
+class ColumnarEngine:
+    """
+    In-memory columns of the views for /blog-views/, /top/ and /performance/ (ANALYTICS_COLUMNAR): per view an
+    int32 blog index and its created_at as int64 epoch microseconds, sorted by time, plus the blog -> author ->
+    country mapping as arrays over the blog indexes. A time window is two binary searches and the per blog counts
+    one bincount of the slice, 12 bytes per view and no SQL on the views.
+
+    New views (by id) are read every ANALYTICS_COLUMNAR_REFRESH seconds into a small delta segment, merged into the
+    main one once it grows past 2% of it. Compaction, deleted blogs and every ANALYTICS_COLUMNAR_RELOAD seconds
+    (renamed users, moved authors) trigger a full reload.
+
+    Refreshes and reloads run in a background thread, outside of the time budget of the request that noticed they
+    were due: requests keep answering from the previous Columns until the new ones replace it in one assignment.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = None
+        self._refreshed_at = 0.0
+        self._loaded_at = 0.0
+        self._reload_blogs = False
+        self._refreshing = None  # thread of the running refresh
+
+    def columns(self):
+        """The current Columns, None until the first load is done. Starts a background refresh when one is due."""
+        if time.monotonic() - self._refreshed_at >= settings.ANALYTICS_COLUMNAR_REFRESH:
+            self._start_refresh()
+        return self._columns
+
+    def refresh(self):
+        # Refresh now and wait for it (warm-up, check_columnar), joins the background refresh if one is running
+        self._start_refresh(force=True).join()
+        return self._columns
+
+    def _start_refresh(self, force=False):
+        with self._lock:
+            due = force or time.monotonic() - self._refreshed_at >= settings.ANALYTICS_COLUMNAR_REFRESH
+            if self._refreshing is None and due:
+                self._refreshing = threading.Thread(target=self._refresh_in_background, name="columnar-refresh", daemon=True)
+                self._refreshing.start()
+            return self._refreshing
+
+    def _refresh_in_background(self):
+        try:
+            self._columns = self._refresh(self._columns)
+        except Exception:
+            # the previous columns keep serving, the next request after ANALYTICS_COLUMNAR_REFRESH retries
+            logger.exception("Columnar engine refresh failed")
+        finally:
+            self._refreshed_at = time.monotonic()
+            connection.close()  # this thread's connection, back to the pool
+            with self._lock:
+                self._refreshing = None
+
+    def load(self):
+        signature = _signature()
+        blogs = BlogMap()
+        main, last_id, self._reload_blogs = _read_views(blogs, 0)
+        self._loaded_at = time.monotonic()
+        return Columns(blogs, main.with_checkpoints(len(blogs)), Segment.empty(), _read_daily(blogs), last_id, signature)
+
+    def _refresh(self, columns):
+        if (
+            columns is None
+            or time.monotonic() - self._loaded_at >= settings.ANALYTICS_COLUMNAR_RELOAD
+            or _signature() != columns.signature
+        ):
+            return self.load()
+
+        blogs = columns.blogs
+        if self._reload_blogs or (Blog.objects.aggregate(last=Max("id"))["last"] or 0) != blogs.last_id:
+            blogs = BlogMap()
+            if len(blogs) < len(columns.blogs) or not np.array_equal(blogs.ids[:len(columns.blogs)], columns.blogs.ids):
+                return self.load()  # blogs were deleted or inserted below the last id, the indexes moved
+
+        new, last_id, self._reload_blogs = _read_views(blogs, columns.last_id)
+        main, delta = columns.main, columns.delta.merge(new, len(blogs))
+        if len(delta) > max(len(main) // 50, 10_000):
+            main, delta = main.merge(delta, len(blogs)), Segment.empty()
+        return Columns(blogs, main, delta, columns.daily, last_id, columns.signature)
+
+    def stats(self):
+        columns = self.columns()
+        if columns is None:
+            return None
+        return {
+            "blogs": len(columns.blogs),
+            "views": len(columns.main) + len(columns.delta),
+            "delta": len(columns.delta),
+            "daily_rows": len(columns.daily),
+            "bytes": sum(segment.nbytes for segment in [*columns.segments, columns.daily]),
+        }
+
+    @staticmethod
+    def _blog_counts(columns, start_date, end_date):
+        # Views of every blog index in [start_date, end_date], compacted days counted whole (see compacted_daily)
+        n = len(columns.blogs)
+        counts = np.zeros(n, dtype=np.int64)
+        start_us, end_us = to_us(start_date), to_us(end_date)
+        for segment in columns.segments:
+            counts += segment.counts(*segment.window(start_us, end_us), n)
+        daily = columns.daily
+        counts += daily.counts(*daily.window(to_us(start_date.date()), to_us((end_date - ONE_US).date())), n)
+        return counts
+
+    @staticmethod
+    def _blog_qs_mask(columns, blog_qs):
+        return columns.blogs.mask(blog_qs.order_by().values_list("id", flat=True) if blog_qs.query.where else None)
+
+    def _group_totals(self, columns, blog_qs, group_field, start_date, end_date):
+        # (codes, names, y, z): blogs of blog_qs (y) and their views (z) per code of group_field
+        codes, names = columns.blogs.groups[group_field]
+        counts = self._blog_counts(columns, start_date, end_date)
+        mask = self._blog_qs_mask(columns, blog_qs)
+        if mask is not None:
+            codes, counts = codes[mask], counts[mask]
+        y = np.bincount(codes, minlength=len(names))
+        z = np.bincount(codes, weights=counts, minlength=len(names)).astype(np.int64)
+        return names, y, z
+
+    def group_totals(self, blog_qs, group_field, start_date, end_date):
+        """{x, y, z} rows of /blog-views/: blogs of blog_qs and their views per user or country, most viewed first."""
+        names, y, z = self._group_totals(self.columns(), blog_qs, group_field, start_date, end_date)
+        present = np.flatnonzero(y)
+        order = present[np.lexsort((present, -z[present]))]
+        return [{"x": names[code], "y": y_value, "z": z_value} for code, y_value, z_value in zip(order.tolist(), y[order].tolist(), z[order].tolist())]
+
+    def top_totals(self, blog_qs, group_field, start_date, end_date, n, per_field=None, ties=True):
+        """
+        Rows of /top/: the n most viewed users, countries or blogs (group_field 'id', y is the title), or with
+        per_field the first n of every user/country ranked like the RANK() (ties) or ROW_NUMBER() window.
+        """
+        columns = self.columns()
+        names, y, z = self._group_totals(columns, blog_qs, group_field, start_date, end_date)
+        present = np.flatnonzero(y)
+
+        if per_field is None:
+            if len(present) > n:
+                # only the rows that can make the top n are sorted
+                nth = -np.partition(-z[present], n - 1)[n - 1]
+                present = present[z[present] >= nth]
+            codes = present[np.lexsort((present, -z[present]))][:n]
+            groups = ranks = None
+        else:
+            # every user/blog belongs to a single user/country, the group of a code comes from any of its blogs
+            blog_codes = columns.blogs.groups[group_field][0]
+            per_codes, per_names = columns.blogs.groups[per_field]
+            group_of = np.zeros(len(names), dtype=np.int32)
+            group_of[blog_codes] = per_codes
+
+            # group, then most views: one int64 key, the stable sort keeps the codes (names) ascending among ties
+            z_max = int(z.max()) + 1 if len(z) else 1
+            codes = present[np.argsort(group_of[present].astype(np.int64) * z_max + (z_max - 1 - z[present]), kind="stable")]
+            groups = group_of[codes]
+            positions = np.arange(len(codes))
+            # first position of every group and of every run of tied views within it
+            new_group = np.ones(len(codes), dtype=bool)
+            new_group[1:] = groups[1:] != groups[:-1]
+            group_start = np.maximum.accumulate(np.where(new_group, positions, 0)) if len(codes) else positions
+            if ties:
+                new_rank = new_group.copy()
+                new_rank[1:] |= z[codes][1:] != z[codes][:-1]
+                ranks = np.maximum.accumulate(np.where(new_rank, positions, 0)) - group_start + 1 if len(codes) else positions
+            else:
+                ranks = positions - group_start + 1
+            keep = ranks <= n
+            codes, groups, ranks = codes[keep], groups[keep], ranks[keep]
+
+        codes = codes.tolist()
+        if group_field == "id":
+            titles = dict(Blog.objects.filter(id__in=[names[code] for code in codes]).values_list("id", "title"))
+            y_values = [titles.get(names[code]) for code in codes]
+        else:
+            y_values = y[codes].tolist()
+        z_values = z[codes].tolist()
+
+        if per_field is None:
+            return [{"x": names[code], "y": y_value, "z": z_value} for code, y_value, z_value in zip(codes, y_values, z_values)]
+        return [
+            {"x": names[code], "group": per_names[group], "y": y_value, "z": z_value, "rank": rank}
+            for code, group, rank, y_value, z_value in zip(codes, groups.tolist(), ranks.tolist(), y_values, z_values)
+        ]
+
+    def periods(self, compare, start_date, end_date, blog_ids=None):
+        """{period, views_count, blogs_count} rows of /performance/ for the blogs of `blog_ids` (None: all)."""
+        columns = self.columns()
+        mask = columns.blogs.mask(blog_ids)
+
+        utc_start, utc_end = start_date.astimezone(dt_timezone.utc), end_date.astimezone(dt_timezone.utc)
+        starts = [PERIOD_STARTS[compare](utc_start)]
+        while starts[-1] + PERIOD_STEPS[compare] <= utc_end:
+            starts.append(starts[-1] + PERIOD_STEPS[compare])
+        bounds = np.array([to_us(start) for start in starts] + [to_us(utc_end) + 1], dtype=np.int64)
+
+        # the rows of a period are contiguous in every segment, their per blog counts give views and distinct blogs
+        start_us, end_us = to_us(start_date), to_us(end_date)
+        windows = [(segment, segment.window(start_us, end_us)) for segment in columns.segments]
+        windows.append((columns.daily, columns.daily.window(to_us(start_date.date()), to_us((end_date - ONE_US).date()))))
+        cuts = [first + np.searchsorted(segment.times[first:last], bounds) for segment, (first, last) in windows]
+
+        rows = []
+        n_blogs = len(columns.blogs)
+        for i, start in enumerate(starts):
+            slices = [(segment, cut[i], cut[i + 1]) for (segment, _), cut in zip(windows, cuts) if cut[i + 1] > cut[i]]
+            if not slices:
+                continue
+            if sum(last - first for _, first, last in slices) > n_blogs:
+                # long period: per blog counts, from the checkpoints for the most part
+                counts = sum(segment.counts(first, last, n_blogs) for segment, first, last in slices)
+                if mask is not None:
+                    counts = counts[mask]
+                views_count, blogs_count = int(counts.sum()), int(np.count_nonzero(counts))
+            else:
+                # short period: cheaper to take its rows apart than to count over every blog
+                views_count, blogs = 0, []
+                for segment, first, last in slices:
+                    keep = mask[segment.blogs[first:last]] if mask is not None else slice(None)
+                    blogs.append(segment.blogs[first:last][keep])
+                    views_count += len(blogs[-1]) if segment.views is None else int(segment.views[first:last][keep].sum())
+                blogs = np.sort(np.concatenate(blogs))
+                blogs_count = int(np.count_nonzero(blogs[1:] != blogs[:-1])) + 1 if len(blogs) else 0
+            if views_count:
+                rows.append({"period": start, "views_count": views_count, "blogs_count": blogs_count})
+        return rows
+
+
+columnar_engine = ColumnarEngine()
@@ -0,0 +1,160 @@
+from collections import defaultdict
+from itertools import combinations
+
+from django.db import connection
+from django.db.models import Count, DateField, F, Sum, Value
+from django.db.models.functions import Trunc
+
+from analytics.models import ShardedBlogView
+from analytics.sharding import scatter
+
+# BlogView / BlogViewDaily path of every dimension but period, which truncates the view time to the granularity
+DIMENSION_FIELDS = {
+    "country": "blog__author__country__name",
+    "user": "blog__author__username",
+    "blog": "blog_id",
+    "viewer_country": "viewer_country__name",
+}
+DIMENSIONS = [*DIMENSION_FIELDS, "period"]
+
+
+def grouping_sets(dimensions, mode="rollup"):
+    """
+    Subtotals of a cube request, most detailed first. rollup is the drill-down tree of the dimensions in the given
+    order: (country, user), (country), (). cube is every combination of them.
+    """
+    if mode == "cube":
+        return [list(subset) for size in range(len(dimensions), -1, -1) for subset in combinations(dimensions, size)]
+    return [dimensions[:size] for size in range(len(dimensions), -1, -1)]
+
+
+def _dimension_columns(dimensions, granularity, time_field):
+    columns = {}
+    for dim in dimensions:
+        if dim == "period":
+            columns["dim_period"] = Trunc(time_field, granularity, output_field=DateField())
+        else:
+            columns[f"dim_{dim}"] = F(DIMENSION_FIELDS[dim])
+    return columns
+
+
+def _row(dimensions, grouping_set, values, views, blogs):
+    # Dimensions rolled up in this subtotal are None, `set` tells them apart from a NULL value (e.g. no country)
+    row = {"set": grouping_set}
+    row.update(zip(dimensions, values))
+    row.update(views=views, blogs=blogs)
+    return row
+
+
+def _grouping_sets_query(raw_qs, daily_qs, dimensions, granularity, sets):
+    # Postgres: every subtotal from one scan of the views with GROUP BY GROUPING SETS over the raw rows and the
+    # compacted days. GROUPING() flags the dimensions a result row is rolled up on.
+    source = raw_qs.annotate(**_dimension_columns(dimensions, granularity, "created_at")).values(
+        *(f"dim_{dim}" for dim in dimensions), blog_key=F("blog_id"), view_count=Value(1)
+    )
+    if daily_qs is not None:
+        daily_source = daily_qs.annotate(**_dimension_columns(dimensions, granularity, "day")).values(
+            *(f"dim_{dim}" for dim in dimensions), blog_key=F("blog_id"), view_count=F("views")
+        )
+        source = source.union(daily_source, all=True)
+    sql, params = source.query.sql_with_params()
+
+    columns = [connection.ops.quote_name(f"dim_{dim}") for dim in dimensions]
+    sets_sql = ", ".join(
+        "(" + ", ".join(connection.ops.quote_name(f"dim_{dim}") for dim in grouping_set) + ")" for grouping_set in sets
+    )
+    grouping_bits = {
+        sum(1 << (len(dimensions) - 1 - i) for i, dim in enumerate(dimensions) if dim not in grouping_set): grouping_set
+        for grouping_set in sets
+    }
+    # the raw SQL skips Trunc's converters: DATE_TRUNC gives a timestamp, cast it to the date the ORM path returns
+    selected = [f"{column}::date" if dim == "period" else column for dim, column in zip(dimensions, columns)]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {', '.join(selected)}, GROUPING({', '.join(columns)}), SUM(view_count), COUNT(DISTINCT blog_key) "
+            f"FROM ({sql}) AS source GROUP BY GROUPING SETS ({sets_sql})",
+            params,
+        )
+        return [
+            _row(dimensions, grouping_bits[row[-3]], row[:len(dimensions)], row[-2], row[-1])
+            for row in cursor.fetchall()
+        ]
+
+
+def rollup(finest, dimensions, sets):
+    """
+    Python counterpart of GROUPING SETS: `finest` are (dimension values, blog id, views) rows at the most detailed
+    level, every subtotal is summed from them. Blogs are counted as sets so a blog in several rows counts once.
+    """
+    rows = []
+    for grouping_set in sets:
+        positions = [dimensions.index(dim) for dim in grouping_set]
+        views, blogs = defaultdict(int), defaultdict(set)
+        for values, blog_id, count in finest:
+            key = tuple(values[i] if i in positions else None for i in range(len(dimensions)))
+            views[key] += count
+            blogs[key].add(blog_id)
+        rows.extend(_row(dimensions, grouping_set, key, views[key], len(blogs[key])) for key in views)
+    return rows
+
+
+def _finest_rows(qs, dimensions, granularity, time_field, count):
+    aliases = [f"dim_{dim}" for dim in dimensions]
+    grouped = (
+        qs.annotate(**_dimension_columns(dimensions, granularity, time_field), blog_key=F("blog_id"))
+        .values(*aliases, "blog_key")
+        .annotate(total=count)
+        .order_by()
+    )
+    return [(tuple(row[alias] for alias in aliases), row["blog_key"], row["total"]) for row in grouped]
+
+
+def sort_rows(rows, sets):
+    order = {tuple(grouping_set): i for i, grouping_set in enumerate(sets)}
+    dims = [key for key in rows[0] if key not in ("set", "views", "blogs")] if rows else []
+    rows.sort(key=lambda row: (
+        order[tuple(row["set"])],
+        -row["views"],
+        tuple((row[dim] is None, row[dim]) for dim in dims),
+    ))
+    return rows
+
+
+def cube(raw_qs, daily_qs, dimensions, granularity, sets):
+    """
+    {set, <dimensions>, views, blogs} rows of every grouping set, from filtered BlogView rows and the matching
+    compacted days (None when there are none). One GROUPING SETS query on Postgres, a GROUP BY of the most detailed
+    level rolled up in Python elsewhere.
+    """
+    if connection.vendor == "postgresql":
+        rows = _grouping_sets_query(raw_qs, daily_qs, dimensions, granularity, sets)
+    else:
+        finest = _finest_rows(raw_qs, dimensions, granularity, "created_at", Count("id"))
+        if daily_qs is not None:
+            finest += _finest_rows(daily_qs, dimensions, granularity, "day", Sum("views"))
+        rows = rollup(finest, dimensions, sets)
+    return sort_rows(rows, sets)
+
+
+def _shard_cube_counts(alias, granularity, start_date, end_date, per_period):
+    qs = ShardedBlogView.objects.using(alias).filter(created_at__gte=start_date, created_at__lte=end_date)
+    if per_period:
+        qs = qs.annotate(dim_period=Trunc("created_at", granularity, output_field=DateField()))
+        return list(qs.values("blog_id", "dim_period").annotate(total=Count("id")).values_list("blog_id", "dim_period", "total"))
+    return [(blog_id, None, total) for blog_id, total in qs.values("blog_id").annotate(total=Count("id")).values_list("blog_id", "total")]
+
+
+def sharded_cube(blog_qs, dimensions, granularity, start_date, end_date, sets):
+    # Per (blog, period) counts from every shard, mapped to their country/user from the default database and rolled up
+    blog_dimensions = {
+        blog_id: {"country": country, "user": username, "blog": blog_id}
+        for blog_id, country, username in blog_qs.values_list("id", "author__country__name", "author__username")
+    }
+    finest = []
+    for shard_rows in scatter(_shard_cube_counts, granularity, start_date, end_date, "period" in dimensions):
+        for blog_id, period, total in shard_rows:
+            blog = blog_dimensions.get(blog_id)
+            if blog is not None:
+                values = tuple(period if dim == "period" else blog[dim] for dim in dimensions)
+                finest.append((values, blog_id, total))
+    return sort_rows(rollup(finest, dimensions, sets), sets)
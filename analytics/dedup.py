@@ -0,0 +1,75 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+
+
+class BloomFilter:
+    # Sized for `capacity` keys at `error_rate` false positives, k positions are derived from one blake2b digest
+    # with double hashing
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        # Returns True if the key was (probably) already present
+        present = True
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                present = False
+                self.bits[byte] |= 1 << bit
+        return present
+
+
+class ViewDeduplicator:
+    """
+    Drops repeat views of the same blog from the same IP within a fixed time window.
+
+    Each window gets its own Bloom filter keyed on (blog, ip, window), only the current and the previous window are
+    kept, so memory stays bounded no matter how long the worker runs. A false positive drops a genuine view, the
+    chance of that is `error_rate` per view while the window holds at most `capacity` distinct keys.
+    """
+
+    def __init__(self, window=60, capacity=100_000, error_rate=0.001):
+        self.window = window
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._filters = {}
+        self.seen = 0
+        self.dropped = 0
+
+    def is_duplicate(self, blog_id, ip_address, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        window = int(timestamp // self.window)
+        with self._lock:
+            self.seen += 1
+            bloom = self._filters.get(window)
+            if bloom is None:
+                # rotate, anything older than the previous window can't be hit again by live traffic
+                self._filters = {w: f for w, f in self._filters.items() if w >= window - 1}
+                bloom = self._filters[window] = BloomFilter(self.capacity, self.error_rate)
+            duplicate = bloom.add(f"{blog_id}|{ip_address}|{window}")
+            if duplicate:
+                self.dropped += 1
+        return duplicate
+
+    def stats(self):
+        return {"seen": self.seen, "dropped": self.dropped}
+
+
+deduplicator = ViewDeduplicator(
+    window=settings.ANALYTICS_DEDUP_WINDOW,
+    capacity=settings.ANALYTICS_DEDUP_CAPACITY,
+    error_rate=settings.ANALYTICS_DEDUP_ERROR_RATE,
+)
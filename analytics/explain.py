@@ -0,0 +1,87 @@
+import re
+import time
+
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+# Postgres EXPLAIN (text) and SQLite EXPLAIN QUERY PLAN lines that name the access path of a table
+PG_INDEX_RE = re.compile(r'(?:Index Scan|Index Only Scan|Bitmap Index Scan) (?:Backward )?(?:using|on) "?(\w+)"?')
+PG_SEQ_SCAN_RE = re.compile(r'Seq Scan on "?(\w+)"?')
+SQLITE_INDEX_RE = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+SQLITE_SEQ_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?"?(\w+)"?$')  # a whole line, "SCAN x USING INDEX" reads an index
+# Django aliases the tables of subqueries (U0, V0...), SQLite plans only name the alias
+TABLE_ALIAS_RE = re.compile(r'"(\w+)" (?:AS )?"?([A-Z]\d+)"?')
+
+# What check_query_plans expects from every analytics endpoint on a seeded dataset. A statement may not read the
+# listed tables with a sequential scan and the whole request may not run more than max_queries statements.
+QUERY_PLAN_EXPECTATIONS = [
+    {"path": "/analytics/blog-views/?object_type=user", "max_queries": 1, "no_seq_scan": ["BlogView"]},
+    {"path": "/analytics/blog-views/?object_type=country&range=month", "max_queries": 1, "no_seq_scan": ["BlogView"]},
+    {"path": "/analytics/blog-views/?object_type=viewer_country&range=month", "max_queries": 1, "no_seq_scan": ["BlogView"]},
+    {"path": "/analytics/top/?top=blog", "max_queries": 1, "no_seq_scan": ["BlogView"]},
+    {"path": "/analytics/top/?top=country&range=week", "max_queries": 1, "no_seq_scan": ["BlogView"]},
+    {"path": "/analytics/top/?top=blog&per=country&n=5", "max_queries": 1, "no_seq_scan": ["BlogView"]},
+    {"path": "/analytics/performance/?compare=month", "max_queries": 1, "no_seq_scan": ["BlogView"]},
+    {"path": "/analytics/performance/?compare=day&country=a", "max_queries": 1, "no_seq_scan": ["BlogView"]},
+    {"path": "/analytics/cube/?dimensions=country,user,period&range=month", "max_queries": 1, "no_seq_scan": ["BlogView"]},
+]
+
+
+def explain_sql(sql, analyze=True):
+    """Plan of one captured statement, with the indexes it uses and the tables it reads with a sequential scan."""
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+            cursor.execute(f"EXPLAIN ({options}) {sql}")
+            plan = [row[0] for row in cursor.fetchall()]
+            indexes = [m for line in plan for m in PG_INDEX_RE.findall(line)]
+            seq_scans = [m for line in plan for m in PG_SEQ_SCAN_RE.findall(line)]
+        else:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            plan = [row[-1] for row in cursor.fetchall()]
+            aliases = {alias: table for table, alias in TABLE_ALIAS_RE.findall(sql)}
+            indexes = [m for line in plan for m in SQLITE_INDEX_RE.findall(line)]
+            seq_scans = [aliases.get(m, m) for line in plan for m in SQLITE_SEQ_SCAN_RE.findall(line)]
+    return {"plan": plan, "indexes": sorted(set(indexes)), "seq_scans": sorted(set(seq_scans))}
+
+
+def explain_request(view_cls, query_params, analyze=True):
+    """
+    Run an analytics view's compute() (bypassing the response cache) and return its payload together with every
+    SQL statement it executed, their timings and plans.
+    """
+    with CaptureQueriesContext(connection) as captured:
+        started = time.monotonic()
+        resp = view_cls().compute(query_params)
+        total = time.monotonic() - started
+
+    statements = []
+    for query in captured.captured_queries:
+        sql = query["sql"]
+        entry = {"sql": sql, "ms": round(float(query["time"]) * 1000, 2)}
+        if sql.lstrip().upper().startswith(("SELECT", "WITH")):
+            entry.update(explain_sql(sql, analyze=analyze))
+        statements.append(entry)
+
+    return resp, {"total_ms": round(total * 1000, 2), "query_count": len(statements), "statements": statements}
+
+
+def check_expectation(view_cls, query_params, expectation):
+    """
+    Failures of one QUERY_PLAN_EXPECTATIONS entry. On Postgres sequential scans are disabled for the check so a
+    seq scan in the plan means no index can serve the query, not just that the planner preferred it on a small table.
+    """
+    with transaction.atomic():
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        view_cls().compute(query_params)  # warm the lookups that are cached between requests
+        _, report = explain_request(view_cls, query_params, analyze=False)
+
+    failures = []
+    if report["query_count"] > expectation["max_queries"]:
+        failures.append(f"{report['query_count']} queries, expected at most {expectation['max_queries']}")
+    for statement in report["statements"]:
+        for table in set(statement.get("seq_scans", [])) & set(expectation["no_seq_scan"]):
+            failures.append(f"sequential scan on {table}: {statement['sql'][:200]}")
+    return failures, report
@@ -0,0 +1,44 @@
+import ipaddress
+
+from django.conf import settings
+from django.db import models
+
+
+def pack_ip(value):
+    # 4 bytes for an IPv4 address, 16 for IPv6
+    return ipaddress.ip_address(value).packed
+
+
+def unpack_ip(value):
+    if isinstance(value, str):
+        # text column of the default layout
+        return value
+    value = bytes(value)
+    if len(value) not in (4, 16):
+        # text written into the binary column by a worker still on the old setting
+        return value.decode("ascii")
+    return str(ipaddress.ip_address(value))
+
+
+def packed_ip_db_type(connection):
+    return {"mysql": "varbinary(16)"}.get(connection.vendor, connection.data_types["BinaryField"])
+
+
+class PackedIPAddressField(models.GenericIPAddressField):
+    """
+    GenericIPAddressField written as 4 or 16 bytes of binary with ANALYTICS_COMPACT_VIEWS, once
+    migrate_blog_view_layout has swapped in the table with a binary column. The column type of the migrations stays
+    the one of GenericIPAddressField whatever the setting, the layout is only ever changed by that command.
+    """
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not settings.ANALYTICS_COMPACT_VIEWS:
+            return super().get_db_prep_value(value, connection, prepared)
+        if not prepared:
+            value = self.get_prep_value(value)
+        return pack_ip(value) if value else None
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return unpack_ip(value)
@@ -0,0 +1,140 @@
+import csv
+import gzip
+import ipaddress
+import socket
+import threading
+from array import array
+from bisect import bisect_right
+
+import pycountry
+from django.conf import settings
+
+from users.models import Country
+
+UNKNOWN_CODES = {"", "-", "ZZ", "XX"}
+
+_table = None
+_table_lock = threading.Lock()
+_country_ids = {}
+
+
+def _parse_ip(value):
+    # "1.2.3.4", "2001:db8::" or the integer form used by some range files (IP2Location)
+    value = value.strip()
+    if value.isdigit():
+        number = int(value)
+        return (4 if number <= 0xFFFFFFFF else 6), number
+    address = ipaddress.ip_address(value)
+    return address.version, int(address)
+
+
+class IPCountryTable:
+    """
+    Country of an IP address from sorted, non-overlapping IP ranges. IPv4 ranges are kept in two array('I') of range
+    starts and ends (4 bytes each) and a country index array('H') into the interned codes, so a full country table
+    of a few hundred thousand ranges takes a few MB. IPv6 ranges, far fewer, are kept in lists of ints. A lookup
+    is one binary search on the range starts.
+    """
+
+    def __init__(self, ranges):
+        # ranges: iterable of (version, start, end, code)
+        self.codes = []
+        code_index = {}
+        per_version = {4: [], 6: []}
+        for version, start, end, code in ranges:
+            if code not in code_index:
+                code_index[code] = len(self.codes)
+                self.codes.append(code)
+            per_version[version].append((start, end, code_index[code]))
+
+        self.v4_starts, self.v4_ends, self.v4_codes = array("I"), array("I"), array("H")
+        self.v6_starts, self.v6_ends, self.v6_codes = [], [], array("H")
+        for version, starts, ends, codes in ((4, self.v4_starts, self.v4_ends, self.v4_codes), (6, self.v6_starts, self.v6_ends, self.v6_codes)):
+            for start, end, code in sorted(per_version[version]):
+                if ends and codes[-1] == code and start == ends[-1] + 1:
+                    ends[-1] = end  # adjacent ranges of the same country are merged
+                    continue
+                starts.append(start)
+                ends.append(end)
+                codes.append(code)
+
+    @classmethod
+    def from_csv(cls, path):
+        """
+        Load a start,end,country CSV (db-ip / IP2Location "lite" country files). Addresses can be written out or
+        given as integers, extra columns and lines that don't parse (headers, comments) are ignored.
+        """
+        opener = gzip.open if str(path).endswith(".gz") else open
+        with opener(path, "rt", newline="") as f:
+            return cls(cls._read_ranges(csv.reader(f)))
+
+    @staticmethod
+    def _read_ranges(rows):
+        for row in rows:
+            if len(row) < 3:
+                continue
+            code = row[2].strip().upper()
+            if code in UNKNOWN_CODES:
+                continue
+            try:
+                version, start = _parse_ip(row[0])
+                _, end = _parse_ip(row[1])
+            except ValueError:
+                continue
+            yield version, start, end, code
+
+    def __len__(self):
+        return len(self.v4_starts) + len(self.v6_starts)
+
+    def lookup(self, ip):
+        # ISO 3166 alpha-2 code of the address or None when it isn't covered (or isn't an address)
+        try:
+            starts, ends, codes = self.v4_starts, self.v4_ends, self.v4_codes
+            if ":" not in ip:
+                if ip.count(".") != 3:
+                    return None  # inet_aton also takes shorthands like "10.1"
+                number = int.from_bytes(socket.inet_aton(ip), "big")
+            else:
+                address = ipaddress.IPv6Address(ip)
+                if address.ipv4_mapped:
+                    number = int(address.ipv4_mapped)
+                else:
+                    starts, ends, codes = self.v6_starts, self.v6_ends, self.v6_codes
+                    number = int(address)
+        except (OSError, ValueError, AttributeError):
+            return None
+
+        i = bisect_right(starts, number) - 1
+        if i >= 0 and number <= ends[i]:
+            return self.codes[codes[i]]
+        return None
+
+
+def country_table():
+    # Table of ANALYTICS_GEOIP_CSV, loaded once per process on first use, None when no file is configured
+    global _table
+    if _table is None and settings.ANALYTICS_GEOIP_CSV:
+        with _table_lock:
+            if _table is None:
+                _table = IPCountryTable.from_csv(settings.ANALYTICS_GEOIP_CSV)
+    return _table
+
+
+def country_id(code):
+    # Country row of an ISO code, created on first sight of a country that isn't in the table yet
+    if code not in _country_ids:
+        country = Country.objects.filter(code=code).first()
+        if country is None:
+            known = pycountry.countries.get(alpha_2=code)
+            country, _ = Country.objects.get_or_create(code=code, defaults={"name": known.name if known else code})
+        _country_ids[code] = country.id
+    return _country_ids[code]
+
+
+def viewer_country_for_ip(ip_address):
+    """Country id of a viewer's IP address, None when it's unknown or no geo table is configured."""
+    table = country_table()
+    if table is None or not ip_address:
+        return None
+    code = table.lookup(ip_address)
+    return country_id(code) if code else None
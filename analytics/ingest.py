@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.utils import timezone
+
+from analytics.dedup import deduplicator
+from analytics.geoip import viewer_country_for_ip
+from analytics.live import live_counters
+from analytics.models import BlogView, ShardedBlogView
+from analytics.sharding import shard_for, sharding_enabled
+
+
+def record_view(blog, ip_address=None, created_at=None):
+    """
+    Single entry point for recording a blog view: stores the BlogView row and feeds the live counters.
+    `blog` should come with author and author__country selected, they are used by the live counters.
+    Returns None when the view is dropped as a repeat of the same blog from the same IP (ANALYTICS_DEDUP_ENABLED).
+    """
+    created_at = created_at or timezone.now()
+
+    if settings.ANALYTICS_DEDUP_ENABLED and ip_address:
+        if deduplicator.is_duplicate(blog.id, ip_address, created_at.timestamp()):
+            return None
+
+    if sharding_enabled():
+        view = ShardedBlogView.objects.using(shard_for(blog.id)).create(blog_id=blog.id, ip_address=ip_address, created_at=created_at)
+    else:
+        view = BlogView.objects.create(blog=blog, ip_address=ip_address, viewer_country_id=viewer_country_for_ip(ip_address), created_at=created_at)
+
+    author = blog.author
+    live_counters.add(
+        blog_id=blog.id,
+        title=blog.title,
+        username=author.username,
+        country=author.country.name if author.country_id else None,
+        timestamp=view.created_at.timestamp(),
+    )
+    return view
@@ -0,0 +1,87 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Q
+from django.http import QueryDict
+from django.utils import timezone
+
+from analytics.budget import time_budget
+from analytics.models import AnalyticsJob
+
+logger = logging.getLogger("django")
+
+
+def enqueue(view_cls, query_params):
+    """
+    Job computing view_cls for query_params in the background. A pending, running or still valid finished job of
+    the same request is returned instead of queueing the same work twice.
+    """
+    key = view_cls.cache_key(query_params)
+
+    def existing():
+        return (
+            AnalyticsJob.objects
+            .filter(key=key)
+            .filter(Q(status__in=[AnalyticsJob.PENDING, AnalyticsJob.RUNNING]) | Q(status=AnalyticsJob.DONE, expires_at__gt=timezone.now()))
+            .order_by('-created_at')
+            .first()
+        )
+
+    job = existing()
+    if job is None:
+        try:
+            with transaction.atomic():
+                job = AnalyticsJob.objects.create(key=key, endpoint=view_cls.endpoint, query_string=query_params.urlencode())
+        except IntegrityError:
+            # an identical request queued its job in between (unique_active_analyticsjob)
+            job = existing()
+    return job
+
+
+def claim():
+    # Oldest pending job, marked running with a conditional update so concurrent workers never take the same one
+    while True:
+        job_id = AnalyticsJob.objects.filter(status=AnalyticsJob.PENDING).order_by('created_at').values_list('id', flat=True).first()
+        if job_id is None:
+            return None
+        claimed = AnalyticsJob.objects.filter(id=job_id, status=AnalyticsJob.PENDING).update(status=AnalyticsJob.RUNNING, started_at=timezone.now())
+        if claimed:
+            return AnalyticsJob.objects.get(id=job_id)
+
+
+def run(job, views):
+    """Compute a claimed job within ANALYTICS_JOB_TIME_BUDGET and store its result for ANALYTICS_JOB_TTL seconds."""
+    view_cls = views[job.endpoint]
+    query_params = QueryDict(job.query_string)
+    try:
+        with time_budget(settings.ANALYTICS_JOB_TIME_BUDGET):
+            resp = view_cls().compute(query_params)
+    except DatabaseError as e:
+        job.status, job.error = AnalyticsJob.FAILED, f"Query failed or exceeded the time budget of {settings.ANALYTICS_JOB_TIME_BUDGET}s: {e}"
+    except Exception as e:
+        logger.exception(f"Analytics job {job.id} failed")
+        job.status, job.error = AnalyticsJob.FAILED, str(e)
+    else:
+        job.status, job.result = AnalyticsJob.DONE, resp
+        # later synchronous requests for the same params are served from the cache too
+        cache.set(job.key, resp, settings.ANALYTICS_CACHE_TIMEOUT)
+        cache.set(f"{job.key}:stale", resp, settings.ANALYTICS_STALE_TIMEOUT)
+
+    job.finished_at = timezone.now()
+    job.expires_at = job.finished_at + timedelta(seconds=settings.ANALYTICS_JOB_TTL)
+    job.save(update_fields=['status', 'result', 'error', 'finished_at', 'expires_at'])
+    return job
+
+
+def cleanup():
+    # Drop expired results and requeue jobs whose worker died while running them
+    now = timezone.now()
+    expired, _ = AnalyticsJob.objects.filter(expires_at__lte=now).delete()
+    stale = AnalyticsJob.objects.filter(
+        status=AnalyticsJob.RUNNING,
+        started_at__lt=now - timedelta(seconds=settings.ANALYTICS_JOB_TIME_BUDGET * 2),
+    ).update(status=AnalyticsJob.PENDING, started_at=None)
+    return expired, stale
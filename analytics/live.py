@@ -0,0 +1,142 @@
+import heapq
+import os
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+from analytics.dedup import deduplicator
+
+WORKERS_KEY = "analytics:live:workers"
+SNAPSHOT_KEY = "analytics:live:worker:{pid}"
+
+live_cache = caches["live"]
+
+
+class LiveCounters:
+    """
+    Per-worker sliding window of per-minute view counters.
+
+    The window is a ring buffer of `window` minute slots, each slot holds sparse Counters of the blogs, users and
+    countries viewed in that minute, so adding a view is O(1) and reading the last N minutes is O(active blogs).
+    Every worker periodically publishes its slots to the "live" cache and readers merge the snapshots of all workers.
+    """
+
+    def __init__(self, window=60, publish_interval=5):
+        self.window = window
+        self.publish_interval = publish_interval
+        self._lock = threading.Lock()
+        self._minutes = [None] * window
+        self._slots = [None] * window
+        self._titles = {}
+        self._last_publish = 0.0
+
+    def _slot(self, minute):
+        index = minute % self.window
+        if self._minutes[index] != minute:
+            # the slot still holds a minute that fell out of the window, recycle it
+            self._minutes[index] = minute
+            self._slots[index] = {"blogs": Counter(), "users": Counter(), "countries": Counter()}
+            self._prune_titles(minute)
+        return self._slots[index]
+
+    def _prune_titles(self, minute):
+        # Titles of the blogs left in no minute of the window
+        oldest = minute - self.window
+        live = set()
+        for slot_minute, slot in zip(self._minutes, self._slots):
+            if slot_minute is not None and slot_minute > oldest:
+                live.update(slot["blogs"])
+        self._titles = {blog_id: title for blog_id, title in self._titles.items() if blog_id in live}
+
+    def add(self, blog_id, title, username, country, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        minute = int(timestamp // 60)
+        if minute <= int(time.time() // 60) - self.window:
+            return  # older than the window (backfills, seeding)
+
+        with self._lock:
+            slot = self._slot(minute)
+            slot["blogs"][blog_id] += 1
+            slot["users"][username] += 1
+            if country:
+                slot["countries"][country] += 1
+            self._titles[blog_id] = title
+
+        if time.monotonic() - self._last_publish >= self.publish_interval:
+            self.publish()
+
+    def snapshot(self):
+        oldest = int(time.time() // 60) - self.window
+        with self._lock:
+            slots = {
+                minute: {name: dict(counter) for name, counter in slot.items()}
+                for minute, slot in zip(self._minutes, self._slots)
+                if minute is not None and minute > oldest
+            }
+            titles = {blog_id: self._titles[blog_id] for slot in slots.values() for blog_id in slot["blogs"]}
+        return {"slots": slots, "titles": titles, "dedup": deduplicator.stats()}
+
+    def publish(self):
+        # Snapshots expire with the window, so a dead worker drops out of the merge on its own. Its pid stays
+        # registered ({pid: expiry}) as long as its snapshot, renewed once half of that is used up.
+        self._last_publish = time.monotonic()
+        pid = os.getpid()
+        timeout = self.window * 60
+        live_cache.set(SNAPSHOT_KEY.format(pid=pid), self.snapshot(), timeout)
+        now = time.time()
+        workers = live_workers(now)
+        if workers.get(pid, 0) < now + timeout / 2:
+            workers[pid] = now + timeout
+            live_cache.set(WORKERS_KEY, workers, timeout)
+
+
+def live_workers(now=None):
+    # {pid: expiry} of the workers that published within the window, recycled workers are dropped
+    now = time.time() if now is None else now
+    workers = live_cache.get(WORKERS_KEY)
+    if not isinstance(workers, dict):  # nothing published yet, or the plain set of pids of earlier versions
+        return {}
+    return {pid: expiry for pid, expiry in workers.items() if expiry > now}
+
+
+def merged_snapshots():
+    # Falls back to the local counters when the cache isn't shared between workers (or nothing was published yet)
+    live_counters.publish()
+    snapshots = live_cache.get_many([SNAPSHOT_KEY.format(pid=pid) for pid in live_workers()])
+    return list(snapshots.values()) or [live_counters.snapshot()]
+
+
+def top_live(snapshots, minutes, n=10):
+    """Top blogs, users and countries over the last `minutes` minutes of the given worker snapshots."""
+    since = int(time.time() // 60) - minutes
+    totals = {"blogs": Counter(), "users": Counter(), "countries": Counter()}
+    titles = {}
+    for snapshot in snapshots:
+        titles.update(snapshot["titles"])
+        for minute, slot in snapshot["slots"].items():
+            if minute > since:
+                for name, counts in slot.items():
+                    totals[name].update(counts)
+
+    def top(counter):
+        return heapq.nlargest(n, counter.items(), key=lambda item: item[1])
+
+    return {
+        "blogs": [{"x": blog_id, "y": titles.get(blog_id), "z": views} for blog_id, views in top(totals["blogs"])],
+        "users": [{"x": username, "z": views} for username, views in top(totals["users"])],
+        "countries": [{"x": country, "z": views} for country, views in top(totals["countries"])],
+    }
+
+
+def dedup_totals(snapshots):
+    # Views seen by the dedup stage and the ones it dropped, i.e. the database writes it saved
+    totals = Counter()
+    for snapshot in snapshots:
+        totals.update(snapshot.get("dedup", {}))
+    return {"seen": totals["seen"], "dropped": totals["dropped"]}
+
+
+live_counters = LiveCounters(settings.ANALYTICS_LIVE_WINDOW, settings.ANALYTICS_LIVE_PUBLISH_INTERVAL)
@@ -0,0 +1,50 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.geoip import country_table, viewer_country_for_ip
+from analytics.models import BlogView
+
+
+class Command(BaseCommand):
+    help = "Set BlogView.viewer_country from ip_address with the ANALYTICS_GEOIP_CSV table, in primary key order batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--after-id", type=int, default=0, help="Resume after this BlogView id (printed with every batch)")
+        parser.add_argument("--all", action="store_true", help="Also recompute views that already have a viewer country, e.g. after a table update")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Seconds to pause between batches")
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        table = country_table()
+        if table is None:
+            raise CommandError("No IP to country table, set ANALYTICS_GEOIP_CSV to a start,end,country CSV file")
+        self.stdout.write(f"{len(table)} IP ranges loaded in {time.monotonic() - started:.1f}s")
+
+        qs = BlogView.objects.filter(ip_address__isnull=False)
+        if not options["all"]:
+            qs = qs.filter(viewer_country__isnull=True)
+
+        last_id, updated, scanned = options["after_id"], 0, 0
+        while True:
+            rows = list(qs.filter(id__gt=last_id).order_by("id").values_list("id", "ip_address", "viewer_country_id")[:options["batch_size"]])
+            if not rows:
+                break
+
+            # one UPDATE per country of the batch instead of one per row
+            per_country = defaultdict(list)
+            for view_id, ip_address, current in rows:
+                country_id = viewer_country_for_ip(ip_address)
+                if country_id != current:
+                    per_country[country_id].append(view_id)
+            for country_id, view_ids in per_country.items():
+                updated += BlogView.objects.filter(id__in=view_ids).update(viewer_country_id=country_id)
+
+            last_id = rows[-1][0]
+            scanned += len(rows)
+            self.stdout.write(f"  {scanned} views scanned, {updated} updated, up to id {last_id}")
+            time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {updated} of {scanned} views updated in {time.monotonic() - started:.1f}s"))
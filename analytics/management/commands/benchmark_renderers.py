@@ -0,0 +1,72 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.http import QueryDict
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from analytics.models import BlogView
+from analytics.renderers import ColumnarRenderer, ORJSONRenderer
+from analytics.views import BlogViewsAnalytics
+from blogs.models import Blog
+from users.models import User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark a large /analytics/blog-views/ response: row dicts + DRF's JSONRenderer vs columnar + orjson. "
+        "The synthetic users, blogs and views are created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000, help="Rows in the response (one user per row)")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per variant, the best one is reported")
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.seed(options["rows"])
+                self.run(options["repeat"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rows):
+        self.stdout.write(f"Creating {rows} users, blogs and views (rolled back afterwards)...")
+        now = timezone.now()
+        users = User.objects.bulk_create([User(username=f"bench-{i}", password="") for i in range(rows)], batch_size=5000)
+        blogs = Blog.objects.bulk_create([Blog(title=f"Bench {i}", author=user, created_at=now) for i, user in enumerate(users)], batch_size=5000)
+        BlogView.objects.bulk_create([BlogView(blog=blog, created_at=now) for blog in blogs], batch_size=5000)
+
+    def measure(self, query_params, renderer, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            resp = BlogViewsAnalytics().compute(QueryDict(query_params))
+            computed = time.perf_counter()
+            body = renderer.render(resp)
+            rendered = time.perf_counter()
+            run = (computed - started, rendered - computed, len(body))
+            best = run if best is None or sum(run[:2]) < sum(best[:2]) else best
+        return best
+
+    def run(self, repeat):
+        variants = [
+            ("rows + JSONRenderer", "object_type=user&range=week", JSONRenderer()),
+            ("rows + ORJSONRenderer", "object_type=user&range=week", ORJSONRenderer()),
+            ("columnar + ORJSONRenderer", "object_type=user&range=week&format=columnar", ColumnarRenderer()),
+        ]
+        baseline = None
+        for name, query_params, renderer in variants:
+            compute, render, size = self.measure(query_params, renderer, repeat)
+            total = compute + render
+            baseline = baseline or total
+            self.stdout.write(
+                f"{name:<28} compute {compute * 1000:8.1f} ms  render {render * 1000:8.1f} ms  "
+                f"total {total * 1000:8.1f} ms  {size / 1024:8.0f} KiB  x{baseline / total:.2f}"
+            )
@@ -0,0 +1,107 @@
+import time
+from collections import Counter
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.utils import timezone
+
+from analytics.columnar import columnar_engine
+from analytics.management.commands.explain_analytics import resolve_analytics_view
+from analytics.sharding import sharding_enabled
+
+# Requests answered by both the ORM and the columnar engine, with and without filters, windows and ranking
+CONSISTENCY_CHECKS = [
+    "/analytics/blog-views/?object_type=user",
+    "/analytics/blog-views/?object_type=country&range=month",
+    "/analytics/blog-views/?object_type=user&range=week&country=a",
+    "/analytics/blog-views/?object_type=country&filter_blog_creation=true",
+    "/analytics/top/?top=blog",
+    "/analytics/top/?top=user&range=month&n=20",
+    "/analytics/top/?top=country&title=a",
+    "/analytics/top/?top=blog&per=country&n=5",
+    "/analytics/top/?top=user&per=country&n=3&ties=false",
+    "/analytics/performance/?compare=day",
+    "/analytics/performance/?compare=week&country=a",
+    "/analytics/performance/?compare=month",
+    "/analytics/performance/?compare=year",
+]
+
+
+def _rows(resp):
+    return [{key: str(value) if key == "x" and value is not None else value for key, value in row.items()} for row in resp["data"]]
+
+
+def compare(path, orm_resp, engine_resp):
+    """
+    Differences between the ORM and engine responses of a request. Rows tied on views may come in another order
+    (collations) and, at the cut of a top n, be other rows: the views of every position have to match and the rows
+    above the last tied value have to be the same.
+    """
+    orm, engine = _rows(orm_resp), _rows(engine_resp)
+    if "/performance/" in path:
+        return [] if orm == engine else [f"rows differ: orm {orm} engine {engine}"]
+
+    def positions(rows):
+        return [(row.get("group"), row.get("rank"), row["z"]) for row in rows]
+
+    def certain(rows):
+        if "/top/" not in path:
+            return Counter(tuple(sorted(row.items())) for row in rows)
+        last = {}
+        for row in rows:
+            last[row.get("group")] = row["z"]
+        return Counter(tuple(sorted(row.items())) for row in rows if row["z"] > last[row.get("group")])
+
+    failures = []
+    if positions(orm) != positions(engine):
+        failures.append(f"views per position differ: orm {positions(orm)[:10]} engine {positions(engine)[:10]}")
+    elif certain(orm) != certain(engine):
+        failures.append(f"rows differ: orm only {list((certain(orm) - certain(engine)).elements())[:5]} engine only {list((certain(engine) - certain(orm)).elements())[:5]}")
+    return failures
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the responses of the columnar engine (ANALYTICS_COLUMNAR) with the ORM queries for a set of "
+        "requests and print both timings. Fails on any difference."
+    )
+
+    def handle(self, *args, **options):
+        if sharding_enabled():
+            raise CommandError("The columnar engine doesn't read sharded views.")
+
+        with override_settings(ANALYTICS_COLUMNAR=True):
+            started = time.perf_counter()
+            columnar_engine.refresh()
+            stats = columnar_engine.stats()
+            self.stdout.write(
+                f"loaded {stats['views']} views of {stats['blogs']} blogs and {stats['daily_rows']} compacted rows "
+                f"({stats['bytes'] / 2 ** 20:.1f} MB) in {time.perf_counter() - started:.2f}s"
+            )
+
+        failed = 0
+        for path in CONSISTENCY_CHECKS:
+            view_cls, query_params = resolve_analytics_view(path)
+            timings = {}
+            responses = {}
+            now = timezone.now()
+            for name, enabled in (("orm", False), ("engine", True)):
+                # both see the same now, the windows of range/compare would otherwise move between the two runs
+                with override_settings(ANALYTICS_COLUMNAR=enabled), mock.patch("django.utils.timezone.now", return_value=now):
+                    started = time.perf_counter()
+                    responses[name] = view_cls().compute(query_params)
+                    timings[name] = (time.perf_counter() - started) * 1000
+
+            failures = compare(path, responses["orm"], responses["engine"])
+            summary = f"{path} (orm {timings['orm']:.1f} ms, engine {timings['engine']:.1f} ms)"
+            if failures:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"FAIL {summary}"))
+                for failure in failures:
+                    self.stdout.write(f"    {failure}")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok   {summary}"))
+
+        if failed:
+            raise CommandError(f"{failed} of {len(CONSISTENCY_CHECKS)} columnar checks failed")
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.explain import QUERY_PLAN_EXPECTATIONS, check_expectation
+from analytics.management.commands.explain_analytics import resolve_analytics_view
+
+
+class Command(BaseCommand):
+    help = (
+        "Fail when an analytics request runs more queries than expected or reads BlogView with a sequential scan. "
+        "Run it on a seeded database (seed_dummy_data)."
+    )
+
+    def handle(self, *args, **options):
+        failed = 0
+        for expectation in QUERY_PLAN_EXPECTATIONS:
+            view_cls, query_params = resolve_analytics_view(expectation["path"])
+            failures, report = check_expectation(view_cls, query_params, expectation)
+            if failures:
+                failed += 1
+                self.stdout.write(self.style.ERROR(f"FAIL {expectation['path']}"))
+                for failure in failures:
+                    self.stdout.write(f"    {failure}")
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok   {expectation['path']} ({report['query_count']} queries, {report['total_ms']} ms)"))
+
+        if failed:
+            raise CommandError(f"{failed} of {len(QUERY_PLAN_EXPECTATIONS)} query plan checks failed")
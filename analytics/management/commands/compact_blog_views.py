@@ -0,0 +1,34 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from analytics.retention import compact_batch
+
+
+class Command(BaseCommand):
+    help = "Roll raw BlogView rows older than N days into per-blog per-day aggregates and delete them in small batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=365, help="Keep raw views of the last N days")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Raw rows compacted and deleted per transaction")
+        parser.add_argument("--sleep", type=float, default=0.1, help="Seconds to pause between batches, lets replication and vacuum keep up")
+        parser.add_argument("--max-batches", type=int, help="Stop after this many batches, for running it in limited maintenance windows")
+
+    def handle(self, *args, **options):
+        # Cut at a day boundary so a compacted day is always complete
+        cutoff = (timezone.now() - timedelta(days=options["days"])).replace(hour=0, minute=0, second=0, microsecond=0)
+        self.stdout.write(f"Compacting views before {cutoff:%Y-%m-%d}...")
+
+        last_id, batches, started = 0, 0, time.monotonic()
+        while options["max_batches"] is None or batches < options["max_batches"]:
+            last_id = compact_batch(cutoff, after_id=last_id, batch_size=options["batch_size"])
+            if last_id is None:
+                break
+            batches += 1
+            if batches % 100 == 0:
+                self.stdout.write(f"  {batches} batches, up to id {last_id} ({time.monotonic() - started:.0f}s)")
+            time.sleep(options["sleep"])
+
+        self.stdout.write(self.style.SUCCESS(f"Compaction done, {batches} batches in {time.monotonic() - started:.1f}s"))
@@ -0,0 +1,48 @@
+import json
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.http import QueryDict
+from django.urls import Resolver404, resolve
+
+from analytics.explain import explain_request
+from analytics.views import AnalyticsAPIView
+
+
+def resolve_analytics_view(path):
+    # "/analytics/top/?top=blog" -> (TopListAnalytics, QueryDict)
+    url = urlsplit(path)
+    try:
+        view_cls = getattr(resolve(url.path).func, "view_class", None)
+    except Resolver404:
+        view_cls = None
+    if view_cls is None or not issubclass(view_cls, AnalyticsAPIView):
+        raise CommandError(f"{url.path} is not an analytics endpoint")
+    return view_cls, QueryDict(url.query)
+
+
+class Command(BaseCommand):
+    help = "Run an analytics request and print every SQL statement with its EXPLAIN (ANALYZE, BUFFERS) plan"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help='Request path with query string, e.g. "/analytics/top/?top=blog&range=month"')
+        parser.add_argument("--no-analyze", action="store_true", help="Plain EXPLAIN, don't execute the statements again")
+        parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        view_cls, query_params = resolve_analytics_view(options["path"])
+        _, report = explain_request(view_cls, query_params, analyze=not options["no_analyze"])
+
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"{options['path']}: {report['query_count']} queries in {report['total_ms']} ms")
+        for number, statement in enumerate(report["statements"], 1):
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n#{number} ({statement['ms']} ms)"))
+            self.stdout.write(statement["sql"])
+            if "plan" in statement:
+                self.stdout.write("\n".join(f"    {line}" for line in statement["plan"]))
+                self.stdout.write(f"  indexes: {', '.join(statement['indexes']) or '-'}")
+                if statement["seq_scans"]:
+                    self.stdout.write(self.style.WARNING(f"  sequential scans: {', '.join(statement['seq_scans'])}"))
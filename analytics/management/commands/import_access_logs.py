@@ -0,0 +1,197 @@
+import csv
+import gzip
+import io
+import ipaddress
+import json
+import os
+import re
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+from multiprocessing import Pool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from analytics.fields import pack_ip
+from analytics.geoip import viewer_country_for_ip
+from analytics.models import BlogView
+from blogs.models import Blog
+
+# Common/combined log format, used by both nginx and gunicorn's default access_log_format:
+# 1.2.3.4 - - [10/Oct/2025:13:55:36 +0000] "GET /blogs/42/ HTTP/1.1" 200 512 "-" "Mozilla/5.0 ..."
+LINE_RE = re.compile(r'^(?P<ip>\S+) \S+ \S+ \[(?P<time>[^\]]+)\] "(?P<method>[A-Z]+) (?P<path>\S+)[^"]*" (?P<status>\d{3}) ')
+MONTHS = {m: i for i, m in enumerate(["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"], 1)}
+
+_path_re = None
+
+
+def _init_worker(path_pattern):
+    global _path_re
+    _path_re = re.compile(path_pattern)
+
+
+def parse_log_time(value):
+    # "10/Oct/2025:13:55:36 +0000" - slicing is several times faster than strptime on millions of lines
+    offset = (int(value[22:24]) * 60 + int(value[24:26])) * (-1 if value[21] == "-" else 1)
+    local = datetime(int(value[7:11]), MONTHS[value[3:6]], int(value[0:2]), int(value[12:14]), int(value[15:17]), int(value[18:20]))
+    return (local - timedelta(minutes=offset)).replace(tzinfo=dt_timezone.utc)
+
+
+def parse_chunk(lines):
+    """Runs in the pool, returns (blog_id, ip, created_at) for every successful GET of a blog page."""
+    rows = []
+    for line in lines:
+        match = LINE_RE.match(line)
+        if not match or match["method"] != "GET" or not match["status"].startswith("2"):
+            continue
+        path_match = _path_re.match(match["path"])
+        if not path_match:
+            continue
+        try:
+            created_at = parse_log_time(match["time"])
+        except (ValueError, KeyError, IndexError):
+            continue
+        try:
+            ip = str(ipaddress.ip_address(match["ip"]))
+        except ValueError:
+            ip = None  # e.g. "-" when gunicorn listens on a unix socket
+        rows.append((int(path_match["blog"]), ip, created_at))
+    return len(lines), rows
+
+
+def open_log(path):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def read_chunks(log_file, chunk_lines):
+    # Yields (lines, end_offset) so the caller can checkpoint the exact position after a chunk is stored
+    offset = log_file.tell()
+    chunk = []
+    for raw in log_file:
+        offset += len(raw)
+        chunk.append(raw.decode("utf-8", errors="replace"))
+        if len(chunk) >= chunk_lines:
+            yield chunk, offset
+            chunk = []
+    if chunk:
+        yield chunk, offset
+
+
+class Command(BaseCommand):
+    help = "Import blog views from (optionally gzipped) nginx/gunicorn access logs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Access log files, *.gz files are decompressed on the fly")
+        parser.add_argument("--path-pattern", default=r"^/blogs/(?P<blog>\d+)/?(\?|$)", help="Regex matching a blog page request path, with a named group 'blog' for the blog id")
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Parser processes")
+        parser.add_argument("--chunk-lines", type=int, default=50_000, help="Lines per parse task, a checkpoint is written after each chunk")
+        parser.add_argument("--batch-size", type=int, default=5_000, help="Rows per bulk_create batch (non Postgres databases)")
+        parser.add_argument("--checkpoint", help="Checkpoint file shared by all paths, keyed by log path. Default: <path>.checkpoint next to each log")
+        parser.add_argument("--restart", action="store_true", help="Ignore existing checkpoints and import from the start")
+
+    def handle(self, *args, **options):
+        try:
+            re.compile(options["path_pattern"]).groupindex["blog"]
+        except (re.error, KeyError):
+            raise CommandError("--path-pattern must be a valid regex with a named group 'blog'")
+
+        # Resolve blogs by id once, rows pointing at unknown blogs are skipped instead of failing the whole chunk
+        self.blog_ids = set(Blog.objects.values_list("id", flat=True))
+
+        with Pool(options["workers"], initializer=_init_worker, initargs=(options["path_pattern"],)) as pool:
+            for path in options["paths"]:
+                self.import_file(pool, path, options)
+
+    def load_checkpoint(self, path, options):
+        # A --checkpoint file holds the state of every log keyed by its absolute path, the default one only its log's
+        checkpoint_path = options["checkpoint"] or f"{path}.checkpoint"
+        key = os.path.abspath(path)
+        states = {}
+        if os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                states = json.load(f)
+            if not options["checkpoint"]:
+                states = {key: states}
+        if options["restart"]:
+            states.pop(key, None)
+        return checkpoint_path, states, key
+
+    def save_checkpoint(self, checkpoint_path, states, key, options):
+        with open(checkpoint_path, "w") as f:
+            json.dump(states if options["checkpoint"] else states[key], f)
+
+    def import_file(self, pool, path, options):
+        checkpoint_path, states, key = self.load_checkpoint(path, options)
+        if key in states:
+            self.stdout.write(f"{path}: resuming after line {states[key]['lines']}")
+        state = states.setdefault(key, {"offset": 0, "lines": 0, "imported": 0, "skipped": 0})
+
+        started = time.monotonic()
+        lines_at_start = state["lines"]
+        with open_log(path) as log_file:
+            log_file.seek(state["offset"])
+            pending = deque()
+            chunks = read_chunks(log_file, options["chunk_lines"])
+
+            # Keep only a couple of chunks per worker in flight (imap would read the whole file ahead), and
+            # consume results in file order so the checkpoint only ever moves forward over stored chunks
+            while True:
+                while len(pending) < options["workers"] * 2:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    lines, offset = chunk
+                    pending.append((pool.apply_async(parse_chunk, (lines,)), offset))
+                if not pending:
+                    break
+
+                result, offset = pending.popleft()
+                line_count, rows = result.get()
+                known = [row for row in rows if row[0] in self.blog_ids]
+                self.store(known, options["batch_size"])
+
+                state["offset"] = offset
+                state["lines"] += line_count
+                state["imported"] += len(known)
+                state["skipped"] += len(rows) - len(known)
+                self.save_checkpoint(checkpoint_path, states, key, options)
+
+                elapsed = time.monotonic() - started
+                rate = (state["lines"] - lines_at_start) / elapsed * 60 if elapsed else 0
+                self.stdout.write(f"{path}: {state['lines']} lines, {state['imported']} views imported, {state['skipped']} unknown blogs ({rate:,.0f} lines/min)")
+
+        self.stdout.write(self.style.SUCCESS(f"{path}: done, {state['imported']} views imported"))
+
+    def store(self, rows, batch_size):
+        if not rows:
+            return
+        if connection.vendor == "postgresql":
+            self.copy_rows(rows)
+        else:
+            with transaction.atomic():
+                BlogView.objects.bulk_create(
+                    [
+                        BlogView(blog_id=blog_id, ip_address=ip, viewer_country_id=viewer_country_for_ip(ip), created_at=created_at)
+                        for blog_id, ip, created_at in rows
+                    ],
+                    batch_size=batch_size,
+                )
+
+    def copy_rows(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for blog_id, ip, created_at in rows:
+            # COPY bypasses the field, bytea is written in its hex text form for the compact layout
+            column = "\\x" + pack_ip(ip).hex() if ip and settings.ANALYTICS_COMPACT_VIEWS else ip
+            writer.writerow((blog_id, column, viewer_country_for_ip(ip), created_at.isoformat()))
+        sql = f'COPY "{BlogView._meta.db_table}" (blog_id, ip_address, viewer_country_id, created_at) FROM STDIN WITH (FORMAT csv)'
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if hasattr(cursor.cursor, "copy_expert"):  # psycopg2
+                buffer.seek(0)
+                cursor.cursor.copy_expert(sql, buffer)
+            else:  # psycopg 3
+                with cursor.cursor.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
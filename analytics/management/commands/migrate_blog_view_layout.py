@@ -0,0 +1,320 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import OperationalError, connection, transaction
+from django.utils import timezone
+
+from analytics.fields import pack_ip, packed_ip_db_type
+from analytics.models import BlogView
+from blogs.models import Blog
+from users.models import Country
+
+COMPACT_TABLE = "BlogView_compact"
+OLD_TABLE = "BlogView_old"
+COLUMNS = ["id", "created_at", "blog_id", "viewer_country_id", "ip_address"]
+
+# (name, columns, method) of the indexes of the compact layout. No single column B-trees: the foreign keys are
+# covered by the composite indexes (or, for viewer_country, only looked up when a Country is deleted) and the
+# created_at B-tree is replaced by a BRIN on Postgres, a few pages for the whole table since views arrive in time order.
+COMPACT_INDEXES = [
+    ("blogview_created_blog", ["created_at", "blog_id"], None),  # range aggregations read blog ids from the index
+    ("blogview_c_blog_created", ["blog_id", "created_at"], None),  # per blog windows of with_view_counts, see swap
+    ("blogview_created_brin", ["created_at"], "brin"),
+]
+# Index of the model (Meta.indexes) taken over by the compact table on swap, so later migrations find it by name
+MODEL_INDEX = ("blogview_blog_created", "blogview_c_blog_created")
+SYNC_TRIGGER = "blogview_compact_sync"
+# Foreign keys of the compact table, added on swap: (column, referenced model)
+FOREIGN_KEYS = [("blog_id", Blog), ("viewer_country_id", Country)]
+
+
+def quote(name):
+    return connection.ops.quote_name(name)
+
+
+def create_compact_table():
+    # Fixed width columns first so Postgres doesn't pad between them, the IP address (4 or 16 bytes) last. No foreign
+    # keys until swap: deleting a blog only cascades to BlogView, a constraint here would make it fail.
+    pk_type = f"{connection.data_types['BigAutoField']} NOT NULL PRIMARY KEY {connection.data_types_suffix.get('BigAutoField', '')}"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {quote(COMPACT_TABLE)} ("
+            f"{quote('id')} {pk_type}, "
+            f"{quote('created_at')} {connection.data_types['DateTimeField']} NOT NULL, "
+            f"{quote('blog_id')} {Blog._meta.pk.rel_db_type(connection)} NOT NULL, "
+            f"{quote('viewer_country_id')} {Country._meta.pk.rel_db_type(connection)} NULL, "
+            f"{quote('ip_address')} {packed_ip_db_type(connection)} NULL)"
+        )
+
+
+def create_sync_triggers():
+    """
+    Mirror the deletes (compaction, deleted blogs) and updates (backfill_viewer_country) of rows already copied into
+    the compact table until swap. The IP address isn't updated, nothing rewrites it and SQL can't pack it.
+    """
+    table, compact = quote(BlogView._meta.db_table), quote(COMPACT_TABLE)
+    update = f"UPDATE {compact} SET " + ", ".join(
+        f"{quote(column)} = NEW.{quote(column)}" for column in ("created_at", "blog_id", "viewer_country_id")
+    ) + f" WHERE {quote('id')} = NEW.{quote('id')}"
+    delete = f"DELETE FROM {compact} WHERE {quote('id')} = OLD.{quote('id')}"
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(
+                f"CREATE OR REPLACE FUNCTION {SYNC_TRIGGER}() RETURNS trigger AS $$ BEGIN "
+                f"IF TG_OP = 'DELETE' THEN {delete}; RETURN OLD; END IF; {update}; RETURN NEW; "
+                f"END $$ LANGUAGE plpgsql"
+            )
+            cursor.execute(f"DROP TRIGGER IF EXISTS {SYNC_TRIGGER} ON {table}")
+            cursor.execute(f"CREATE TRIGGER {SYNC_TRIGGER} AFTER DELETE OR UPDATE ON {table} FOR EACH ROW EXECUTE FUNCTION {SYNC_TRIGGER}()")
+        else:
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {SYNC_TRIGGER}_delete AFTER DELETE ON {table} BEGIN {delete}; END")
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {SYNC_TRIGGER}_update AFTER UPDATE ON {table} BEGIN {update}; END")
+
+
+def drop_sync_triggers(cursor):
+    if connection.vendor == "postgresql":
+        cursor.execute(f"DROP TRIGGER IF EXISTS {SYNC_TRIGGER} ON {quote(BlogView._meta.db_table)}")
+        cursor.execute(f"DROP FUNCTION IF EXISTS {SYNC_TRIGGER}()")
+    else:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {SYNC_TRIGGER}_delete")
+        cursor.execute(f"DROP TRIGGER IF EXISTS {SYNC_TRIGGER}_update")
+
+
+def create_compact_indexes(stdout):
+    with connection.cursor() as cursor:
+        for name, columns, method in COMPACT_INDEXES:
+            if method and connection.vendor != "postgresql":
+                continue
+            started = time.monotonic()
+            using = f" USING {method}" if method else ""
+            options = " WITH (pages_per_range = 32)" if method == "brin" else ""
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {quote(name)} ON {quote(COMPACT_TABLE)}{using} "
+                f"({', '.join(quote(column) for column in columns)}){options}"
+            )
+            stdout.write(f"  index {name} in {time.monotonic() - started:.1f}s")
+        if connection.vendor == "postgresql":
+            cursor.execute(f"ANALYZE {quote(COMPACT_TABLE)}")
+
+
+def copy_batch(cursor, after_id, batch_size):
+    # The next batch of BlogView rows after `after_id` into the compact table, IPs packed. Returns the last id or None.
+    # The rows stay locked until the batch is committed, an update or delete waits and then finds them to sync.
+    rows = list(
+        BlogView.objects.select_for_update().filter(id__gt=after_id).order_by("id")
+        .values_list("id", "created_at", "blog_id", "viewer_country_id", "ip_address")[:batch_size]
+    )
+    if not rows:
+        return None
+    cursor.executemany(
+        f"INSERT INTO {quote(COMPACT_TABLE)} ({', '.join(quote(column) for column in COLUMNS)}) VALUES (%s, %s, %s, %s, %s)",
+        [
+            (view_id, connection.ops.adapt_datetimefield_value(created_at), blog_id, country_id, pack_ip(ip) if ip else None)
+            for view_id, created_at, blog_id, country_id, ip in rows
+        ],
+    )
+    return rows[-1][0]
+
+
+def copied_until():
+    with connection.cursor() as cursor:
+        cursor.execute(f"SELECT MAX({quote('id')}) FROM {quote(COMPACT_TABLE)}")
+        return cursor.fetchone()[0] or 0
+
+
+def table_sizes(table):
+    # {relation: bytes} of a table and each of its indexes, None when the database can't tell
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("SELECT pg_table_size(%s::regclass)", [quote(table)])
+            sizes = {table: cursor.fetchone()[0]}
+            cursor.execute(
+                "SELECT indexrelid::regclass::text, pg_relation_size(indexrelid) FROM pg_index WHERE indrelid = %s::regclass",
+                [quote(table)],
+            )
+            sizes.update(cursor.fetchall())
+            return sizes
+        try:
+            # needs SQLite built with SQLITE_ENABLE_DBSTAT_VTAB
+            cursor.execute(
+                "SELECT name, SUM(pgsize) FROM dbstat WHERE name = %s "
+                "OR name IN (SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s) GROUP BY name",
+                [table, table],
+            )
+        except OperationalError:
+            return None
+        return dict(cursor.fetchall())
+
+
+def scan_timings(table, repeat=3):
+    # Best of `repeat` runs of the range aggregations of the endpoints over the last week/month/year, in ms
+    end = timezone.now()
+    queries = {
+        "count": f"SELECT COUNT(*) FROM {quote(table)} WHERE {quote('created_at')} >= %s AND {quote('created_at')} <= %s",
+        "per blog": (
+            f"SELECT {quote('blog_id')}, COUNT(*) FROM {quote(table)} "
+            f"WHERE {quote('created_at')} >= %s AND {quote('created_at')} <= %s GROUP BY {quote('blog_id')}"
+        ),
+    }
+    timings = {}
+    with connection.cursor() as cursor:
+        for window, days in (("week", 7), ("month", 30), ("year", 365)):
+            params = [connection.ops.adapt_datetimefield_value(end - timedelta(days=days)), connection.ops.adapt_datetimefield_value(end)]
+            for name, sql in queries.items():
+                runs = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                    runs.append((time.perf_counter() - started) * 1000)
+                timings[f"{name} {window}"] = min(runs)
+    return timings
+
+
+class Command(BaseCommand):
+    help = (
+        "Move BlogView to the compact layout online: IPs as 4/16 bytes of binary, fixed width columns first and "
+        "range aggregation indexes ((created_at, blog), (blog, created_at), BRIN(created_at) on Postgres) instead of "
+        "one B-tree per column. copy fills BlogView_compact in primary key batches while the site runs (rerun it to "
+        "resume or catch up, triggers mirror the deletes and updates of copied rows), swap copies the last rows, renames "
+        "the tables and moves the foreign keys under a short write lock, report compares the sizes and range scan times "
+        "of the two layouts, drop-old drops the previous table."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["copy", "swap", "report", "drop-old"])
+        parser.add_argument("--batch-size", type=int, default=20_000, help="Rows copied per transaction")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Seconds to pause between batches")
+
+    def handle(self, *args, **options):
+        if connection.vendor not in ("postgresql", "sqlite"):
+            raise CommandError("The compact layout is only implemented for Postgres and SQLite.")
+        getattr(self, options["action"].replace("-", "_"))(options)
+
+    def tables(self):
+        return set(connection.introspection.table_names())
+
+    def copy(self, options):
+        if OLD_TABLE in self.tables():
+            raise CommandError(f"BlogView has already been swapped to the compact layout ({OLD_TABLE} exists).")
+        create_compact_table()
+        create_sync_triggers()
+        last_id, started = copied_until(), time.monotonic()
+        self.stdout.write(f"Copying BlogView rows after id {last_id} into {COMPACT_TABLE}...")
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:
+                batch_last_id = copy_batch(cursor, last_id, options["batch_size"])
+            if batch_last_id is None:
+                break
+            last_id = batch_last_id
+            self.stdout.write(f"  copied up to id {last_id} ({time.monotonic() - started:.0f}s)")
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+        create_compact_indexes(self.stdout)
+        self.stdout.write(self.style.SUCCESS(f"Copy done up to id {last_id} in {time.monotonic() - started:.1f}s"))
+
+    def swap(self, options):
+        if not settings.ANALYTICS_COMPACT_VIEWS:
+            raise CommandError("Run the swap with ANALYTICS_COMPACT_VIEWS=true, the setting of the workers deployed with it.")
+        if COMPACT_TABLE not in self.tables():
+            raise CommandError(f"{COMPACT_TABLE} doesn't exist, run copy first.")
+
+        table = BlogView._meta.db_table
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                # blocks inserts, not reads, until the renames are committed
+                cursor.execute(f"LOCK TABLE {quote(table)} IN SHARE ROW EXCLUSIVE MODE")
+            last_id = copied_until()
+            while last_id is not None:
+                last_id = copy_batch(cursor, last_id, options["batch_size"])
+
+            drop_sync_triggers(cursor)
+
+            model_name, compact_name = MODEL_INDEX
+            if connection.vendor == "postgresql":
+                # the previous table drops its foreign keys, deleting a blog only cascades to the model's table
+                for name, constraint in connection.introspection.get_constraints(cursor, table).items():
+                    if constraint["foreign_key"]:
+                        cursor.execute(f"ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(name)}")
+                cursor.execute(f"ALTER TABLE {quote(table)} RENAME TO {quote(OLD_TABLE)}")
+                cursor.execute(f"ALTER TABLE {quote(COMPACT_TABLE)} RENAME TO {quote(table)}")
+                # checked for the new rows only, the existing ones are validated after the commit without the lock
+                for column, model in FOREIGN_KEYS:
+                    cursor.execute(
+                        f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(f'{table}_{column}_fk')} FOREIGN KEY ({quote(column)}) "
+                        f"REFERENCES {quote(model._meta.db_table)} ({quote('id')}) DEFERRABLE INITIALLY DEFERRED NOT VALID"
+                    )
+                cursor.execute(f"ALTER INDEX {quote(model_name)} RENAME TO {quote(model_name + '_old')}")
+                cursor.execute(f"ALTER INDEX {quote(compact_name)} RENAME TO {quote(model_name)}")
+            else:
+                # SQLite can neither drop nor add a foreign key without rebuilding the table: the previous table
+                # is dropped right away (run report before swap) and the compact one goes without them. Only the
+                # development database, the ORM's cascade still deletes the views of a deleted blog.
+                cursor.execute(f"DROP TABLE {quote(table)}")
+                cursor.execute(f"ALTER TABLE {quote(COMPACT_TABLE)} RENAME TO {quote(table)}")
+                # index names are per database, the model's one was only freed with the previous table
+                cursor.execute(f"CREATE INDEX {quote(model_name)} ON {quote(table)} ({quote('blog_id')}, {quote('created_at')})")
+                cursor.execute(f"DROP INDEX {quote(compact_name)}")
+            # new views continue after the copied ids
+            for sql in connection.ops.sequence_reset_sql(no_style(), [BlogView]):
+                cursor.execute(sql)
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                for column, _ in FOREIGN_KEYS:
+                    cursor.execute(f"ALTER TABLE {quote(table)} VALIDATE CONSTRAINT {quote(f'{table}_{column}_fk')}")
+            self.stdout.write(self.style.SUCCESS(f"{table} now has the compact layout, the previous table is {OLD_TABLE}."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{table} now has the compact layout, the previous table was dropped."))
+
+    def report(self, options):
+        tables = self.tables()
+        if OLD_TABLE in tables:
+            before, after = OLD_TABLE, BlogView._meta.db_table
+        elif COMPACT_TABLE in tables:
+            before, after = BlogView._meta.db_table, COMPACT_TABLE
+        else:
+            raise CommandError("Nothing to compare, run copy first.")
+
+        with connection.cursor() as cursor:
+            counts = {}
+            for table in (before, after):
+                cursor.execute(f"SELECT COUNT(*) FROM {quote(table)}")
+                counts[table] = cursor.fetchone()[0]
+
+        self.stdout.write(f"{'':<28} {'before':>14} {'after':>14}")
+        self.stdout.write(f"{'table':<28} {before:>14} {after:>14}")
+        self.stdout.write(f"{'rows':<28} {counts[before]:>14} {counts[after]:>14}")
+        if counts[before] != counts[after] and before != OLD_TABLE:
+            self.stdout.write(self.style.WARNING("Row counts differ: rerun copy to catch up with the new views."))
+
+        sizes = {table: table_sizes(table) for table in (before, after)}
+        if None in sizes.values():
+            self.stdout.write("Sizes unavailable (SQLite without the dbstat table).")
+        else:
+            def line(label, values):
+                self.stdout.write(f"{label:<28} {values[0] / 2 ** 20:>11.1f} MB {values[1] / 2 ** 20:>11.1f} MB")
+
+            line("table", [sizes[table][table] for table in (before, after)])
+            line("indexes", [sum(size for name, size in sizes[table].items() if name != table) for table in (before, after)])
+            line("total", [sum(sizes[table].values()) for table in (before, after)])
+            per_row = [sum(sizes[table].values()) / max(counts[table], 1) for table in (before, after)]
+            self.stdout.write(f"{'bytes per row':<28} {per_row[0]:>14.1f} {per_row[1]:>14.1f}")
+            for table in (before, after):
+                for name, size in sorted(sizes[table].items()):
+                    if name != table:
+                        self.stdout.write(f"  {table}: {name} {size / 2 ** 20:.1f} MB")
+
+        timings = {table: scan_timings(table) for table in (before, after)}
+        for query in timings[before]:
+            self.stdout.write(f"{query + ' (ms)':<28} {timings[before][query]:>14.1f} {timings[after][query]:>14.1f}")
+
+    def drop_old(self, options):
+        if OLD_TABLE not in self.tables():
+            raise CommandError(f"{OLD_TABLE} doesn't exist.")
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {quote(OLD_TABLE)}")
+        self.stdout.write(self.style.SUCCESS(f"Dropped {OLD_TABLE}."))
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from analytics import jobs
+from analytics.views import analytics_views
+
+
+class Command(BaseCommand):
+    help = "Process analytics requests queued with ?async=1 (AnalyticsJob table) with a pool of worker threads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2, help="Jobs computed in parallel")
+        parser.add_argument("--poll", type=float, default=1.0, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+
+    def handle(self, *args, **options):
+        self.views = analytics_views()
+        self.stop = threading.Event()
+
+        expired, stale = jobs.cleanup()
+        self.stdout.write(f"Starting {options['workers']} workers ({expired} expired jobs removed, {stale} stale jobs requeued)")
+
+        threads = [
+            threading.Thread(target=self.work, args=(options,), name=f"analytics-job-{i}", daemon=True)
+            for i in range(options["workers"])
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(options["poll"])
+                if not options["once"]:
+                    jobs.cleanup()
+        except KeyboardInterrupt:
+            self.stop.set()
+            self.stdout.write("Stopping, waiting for the running jobs...")
+            for thread in threads:
+                thread.join()
+
+    def work(self, options):
+        try:
+            while not self.stop.is_set():
+                job = jobs.claim()
+                if job is None:
+                    if options["once"]:
+                        return
+                    self.stop.wait(options["poll"])
+                    continue
+
+                started = time.monotonic()
+                job = jobs.run(job, self.views)
+                self.stdout.write(f"{job.status:<7} {job.endpoint}?{job.query_string} ({time.monotonic() - started:.1f}s) {job.error}")
+        finally:
+            connection.close()
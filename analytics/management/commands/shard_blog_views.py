@@ -0,0 +1,41 @@
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from analytics.models import BlogView, ShardedBlogView
+from analytics.sharding import shard_for
+
+
+class Command(BaseCommand):
+    help = "Copy the BlogView rows of the default database into the shards (ANALYTICS_SHARD_URLS), in primary key order"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10_000)
+        parser.add_argument("--after-id", type=int, default=0, help="Resume after this BlogView id (printed with every batch)")
+
+    def handle(self, *args, **options):
+        if not settings.ANALYTICS_SHARDS:
+            raise CommandError("No shards configured, set ANALYTICS_SHARD_URLS and migrate every shard with --database=shard_N")
+
+        last_id, copied, started = options["after_id"], 0, time.monotonic()
+        while True:
+            rows = list(
+                BlogView.objects.filter(id__gt=last_id).order_by("id")
+                .values_list("id", "blog_id", "ip_address", "created_at")[:options["batch_size"]]
+            )
+            if not rows:
+                break
+
+            per_shard = defaultdict(list)
+            for _, blog_id, ip_address, created_at in rows:
+                per_shard[shard_for(blog_id)].append(ShardedBlogView(blog_id=blog_id, ip_address=ip_address, created_at=created_at))
+            for alias, views in per_shard.items():
+                ShardedBlogView.objects.using(alias).bulk_create(views)
+
+            last_id = rows[-1][0]
+            copied += len(rows)
+            self.stdout.write(f"  {copied} views copied, up to id {last_id}")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {copied} views copied in {time.monotonic() - started:.1f}s"))
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0003_alter_blogview_created_at'),
+        ('blogs', '0003_alter_blog_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlogViewDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('views', models.PositiveIntegerField(default=0)),
+                ('blog', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_views', to='blogs.blog')),
+            ],
+            options={
+                'db_table': 'BlogViewDaily',
+                'constraints': [models.UniqueConstraint(fields=('blog', 'day'), name='unique_blog_view_daily')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:49
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0004_blogviewdaily'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShardedBlogView',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('blog_id', models.BigIntegerField(db_index=True)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+            ],
+            options={
+                'db_table': 'BlogViewShard',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-19 05:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0006_analyticsjob'),
+        ('blogs', '0003_alter_blog_created_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='blogview',
+            index=models.Index(fields=['blog', 'created_at'], name='blogview_blog_created'),
+        ),
+    ]
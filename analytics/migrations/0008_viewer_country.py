@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:04
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0007_blogview_blog_created_index'),
+        ('blogs', '0003_alter_blog_created_at'),
+        ('users', '0002_country_alter_user_country'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='blogviewdaily',
+            name='unique_blog_view_daily',
+        ),
+        migrations.AddField(
+            model_name='blogview',
+            name='viewer_country',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='viewer_views', to='users.country'),
+        ),
+        migrations.AddField(
+            model_name='blogviewdaily',
+            name='viewer_country',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='viewer_daily_views', to='users.country'),
+        ),
+        migrations.AddConstraint(
+            model_name='blogviewdaily',
+            constraint=models.UniqueConstraint(fields=('blog', 'day', 'viewer_country'), name='unique_blog_view_daily'),
+        ),
+    ]
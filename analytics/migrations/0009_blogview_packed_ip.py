@@ -0,0 +1,24 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:32
+
+import analytics.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0008_viewer_country'),
+    ]
+
+    operations = [
+        # Same column type, only the state changes: the binary layout is moved to by migrate_blog_view_layout
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AlterField(
+                    model_name='blogview',
+                    name='ip_address',
+                    field=analytics.fields.PackedIPAddressField(blank=True, null=True),
+                ),
+            ],
+        ),
+    ]
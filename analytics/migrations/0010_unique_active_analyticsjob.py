@@ -0,0 +1,28 @@
+# Generated by Django 5.2.8 on 2026-10-19 06:53
+
+from django.db import migrations, models
+
+
+def fail_duplicate_jobs(apps, schema_editor):
+    # Only the oldest queued or running job of a request is kept, the ones enqueued by the race fail
+    AnalyticsJob = apps.get_model('analytics', 'AnalyticsJob')
+    seen = set()
+    for job in AnalyticsJob.objects.filter(status__in=['pending', 'running']).order_by('created_at'):
+        if job.key in seen:
+            AnalyticsJob.objects.filter(id=job.id).update(status='failed', error='Duplicate of an earlier job for the same request.')
+        seen.add(job.key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0009_blogview_packed_ip'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='analyticsjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('key',), name='unique_active_analyticsjob'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.8 on 2026-10-19 07:05
+
+from django.db import migrations, models
+
+
+def merge_duplicate_totals(apps, schema_editor):
+    # Rows of unknown countries were never unique, fold the duplicates of a blog and day into the first one
+    BlogViewDaily = apps.get_model('analytics', 'BlogViewDaily')
+    kept = {}
+    for daily in BlogViewDaily.objects.filter(viewer_country__isnull=True).order_by('id'):
+        first = kept.setdefault((daily.blog_id, daily.day), daily)
+        if first is not daily:
+            first.views += daily.views
+            first.save(update_fields=['views'])
+            daily.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0010_unique_active_analyticsjob'),
+        ('blogs', '0003_alter_blog_created_at'),
+        ('users', '0002_country_alter_user_country'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_totals, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='blogviewdaily',
+            constraint=models.UniqueConstraint(condition=models.Q(('viewer_country__isnull', True)), fields=('blog', 'day'), name='unique_blog_view_daily_no_country'),
+        ),
+    ]
@@ -1,15 +1,92 @@
+import uuid
+
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.utils import timezone
 
+from analytics.fields import PackedIPAddressField
 from blogs.models import Blog
+from users.models import Country
 
 class BlogView(models.Model):
     blog = models.ForeignKey(Blog, related_name='views', on_delete=models.CASCADE)
-    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    ip_address = PackedIPAddressField(null=True, blank=True)  # binary with ANALYTICS_COMPACT_VIEWS, see migrate_blog_view_layout
+    viewer_country = models.ForeignKey(Country, null=True, blank=True, related_name='viewer_views', on_delete=models.SET_NULL)  # from ip_address, see analytics.geoip
     created_at = models.DateTimeField(default=timezone.now, db_index=True) # not using auto_now_add to allow custom timestamps during data seeding
 
     class Meta:
         db_table = "BlogView"
+        indexes = [
+            # per-blog view counts of a time window (with_view_counts) are range scans of this index
+            models.Index(fields=['blog', 'created_at'], name='blogview_blog_created'),
+        ]
 
     def __str__(self):
         return f"{self.blog} - {self.ip_address} - {self.created_at}"
+
+
+class BlogViewDaily(models.Model):
+    # Per-blog per-day view totals of the raw BlogView rows compacted by the retention policy (compact_blog_views)
+    blog = models.ForeignKey(Blog, related_name='daily_views', on_delete=models.CASCADE)
+    day = models.DateField(db_index=True)
+    viewer_country = models.ForeignKey(Country, null=True, blank=True, related_name='viewer_daily_views', on_delete=models.SET_NULL)
+    views = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = "BlogViewDaily"
+        constraints = [
+            models.UniqueConstraint(fields=['blog', 'day', 'viewer_country'], name='unique_blog_view_daily'),
+            # NULLs are distinct in a unique constraint, the views of unknown countries need one of their own
+            models.UniqueConstraint(fields=['blog', 'day'], condition=models.Q(viewer_country__isnull=True), name='unique_blog_view_daily_no_country'),
+        ]
+
+    def __str__(self):
+        return f"{self.blog_id} - {self.day} - {self.views}"
+
+
+class ShardedBlogView(models.Model):
+    # BlogView rows of the sharded storage (ANALYTICS_SHARDS), the table only exists in the shard databases.
+    # Blogs stay in the default database, so blog_id is a plain column instead of a cross-database foreign key.
+    blog_id = models.BigIntegerField(db_index=True)
+    ip_address = models.GenericIPAddressField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = "BlogViewShard"
+
+    def __str__(self):
+        return f"{self.blog_id} - {self.ip_address} - {self.created_at}"
+
+
+class AnalyticsJob(models.Model):
+    # An analytics request computed in the background (?async=1), the table is the queue of run_analytics_jobs
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    key = models.CharField(max_length=255, db_index=True)  # response cache key of the request, identical requests share a job
+    endpoint = models.CharField(max_length=100)
+    query_string = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        db_table = "AnalyticsJob"
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='analyticsjob_status_created'),
+        ]
+        constraints = [
+            # at most one queued or running job per request, concurrent enqueue() calls coalesce on it
+            models.UniqueConstraint(fields=['key'], condition=models.Q(status__in=['pending', 'running']), name='unique_active_analyticsjob'),
+        ]
+
+    def __str__(self):
+        return f"{self.endpoint}?{self.query_string} - {self.status}"
@@ -0,0 +1,25 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to DRF's encoder
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    # orjson serializes dicts, lists, datetimes and UUIDs natively in C, anything else (Decimal, lazy strings,
+    # querysets...) goes through DRF's encoder. Falls back to the stock JSONRenderer when orjson isn't installed.
+    encoder = JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if data is None:
+            return b''
+        return orjson.dumps(data, default=self.encoder.default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+
+class ColumnarRenderer(ORJSONRenderer):
+    # Selected with ?format=columnar, the analytics views then return {"x": [...], "y": [...], "z": [...]} data
+    format = 'columnar'
@@ -0,0 +1,100 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+
+from analytics.models import BlogView, BlogViewDaily
+
+COMPACTED_UNTIL_KEY = "analytics:compacted_until"
+
+
+def compact_batch(cutoff, after_id=0, batch_size=5000):
+    """
+    Roll the next `batch_size` raw views older than `cutoff` (in primary key order, after `after_id`) into
+    BlogViewDaily (per blog, day and viewer country) and delete them, in one transaction. Adding to the aggregates and
+    deleting the raw rows together makes the compaction safe to interrupt and rerun. Returns the last compacted id, or None when there is nothing left.
+    """
+    with transaction.atomic():
+        rows = list(
+            BlogView.objects
+            .filter(created_at__lt=cutoff, id__gt=after_id)
+            .order_by('id')
+            .values_list('id', 'blog_id', 'created_at', 'viewer_country_id')[:batch_size]
+        )
+        if not rows:
+            return None
+
+        counts = Counter((blog_id, created_at.date(), country_id) for _, blog_id, created_at, country_id in rows)
+        existing = {
+            (daily.blog_id, daily.day, daily.viewer_country_id): daily
+            for daily in BlogViewDaily.objects.select_for_update().filter(
+                blog_id__in={blog_id for blog_id, _, _ in counts},
+                day__in={day for _, day, _ in counts},
+            )
+        }
+
+        to_create = []
+        for (blog_id, day, country_id), views in counts.items():
+            daily = existing.get((blog_id, day, country_id))
+            if daily is None:
+                to_create.append(BlogViewDaily(blog_id=blog_id, day=day, viewer_country_id=country_id, views=views))
+            else:
+                daily.views += views
+        BlogViewDaily.objects.bulk_create(to_create)
+        BlogViewDaily.objects.bulk_update(existing.values(), ['views'])
+
+        BlogView.objects.filter(id__in=[row[0] for row in rows]).delete()
+
+    cache.delete(COMPACTED_UNTIL_KEY)
+    return rows[-1][0]
+
+
+def compacted_until():
+    # Last day that has compacted views, cached so the analytics endpoints can skip the aggregates for recent windows
+    day = cache.get(COMPACTED_UNTIL_KEY)
+    if day is None:
+        day = BlogViewDaily.objects.aggregate(day=Max('day'))['day'] or False
+        cache.set(COMPACTED_UNTIL_KEY, day, 600)
+    return day or None
+
+
+def compacted_daily(start_date, end_date):
+    """
+    BlogViewDaily rows of the days of [start_date, end_date] or None when no compacted day falls in the window.
+    Compacted days count as a whole when the window starts or ends in the middle of them, a window ending exactly at
+    midnight doesn't take in the day that starts there.
+    """
+    until = compacted_until()
+    if until is None or start_date.date() > until:
+        return None
+    last_day = (end_date - timedelta(microseconds=1)).date()
+    return BlogViewDaily.objects.filter(day__gte=start_date.date(), day__lte=last_day)
+
+
+def merge_compacted_periods(period_data, raw_qs, daily, trunc_func):
+    """
+    Add the compacted views to the per-period rows of /performance/. A period that straddles the compaction cutoff
+    has views on both sides, its blogs are counted once by comparing the blog ids of that period only.
+    """
+    def day_of(period):
+        return period.date() if isinstance(period, datetime) else period
+
+    merged = {day_of(item['period']): item for item in period_data}
+    daily_periods = (
+        daily.annotate(period=trunc_func('day'))
+        .values('period')
+        .annotate(views_count=Sum('views'), blogs_count=Count('blog', distinct=True))
+    )
+    for item in daily_periods:
+        raw = merged.get(item['period'])
+        if raw is None:
+            merged[item['period']] = item
+            continue
+        raw_blogs = raw_qs.annotate(period=trunc_func('created_at')).filter(period=raw['period']).values_list('blog_id', flat=True)
+        daily_blogs = daily.annotate(period=trunc_func('day')).filter(period=item['period']).values_list('blog_id', flat=True)
+        raw['views_count'] += item['views_count']
+        raw['blogs_count'] = len(set(raw_blogs) | set(daily_blogs))
+
+    return [merged[day] for day in sorted(merged)]
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+
+from analytics.budget import BudgetExceeded, remaining_budget, time_budget
+from analytics.models import ShardedBlogView
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def sharding_enabled():
+    return bool(settings.ANALYTICS_SHARDS)
+
+
+def shard_for(blog_id):
+    # All views of a blog live on the same shard, so per-blog counts and distinct blog counts never overlap.
+    # Blog ids are dense, a plain modulo spreads them evenly.
+    shards = settings.ANALYTICS_SHARDS
+    return shards[int(blog_id) % len(shards)]
+
+
+class ShardRouter:
+    """
+    Routes ShardedBlogView rows to their shard by blog id and keeps the shard databases to that single table.
+    Reads of ShardedBlogView without an instance hint have to pick their shard with .using(), see scatter().
+    """
+
+    def _for_instance(self, model, hints):
+        if model is ShardedBlogView and hints.get("instance") is not None:
+            return shard_for(hints["instance"].blog_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._for_instance(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._for_instance(model, hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.ANALYTICS_SHARDS:
+            return app_label == "analytics" and model_name == "shardedblogview"
+        if model_name == "shardedblogview":
+            return False
+        return None
+
+
+def _shard_executor():
+    # shared by the request threads of a gthread worker, created once
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=len(settings.ANALYTICS_SHARDS), thread_name_prefix="analytics-shard")
+        return _executor
+
+
+def scatter(fn, *args):
+    """
+    Run fn(alias, *args) on every shard in parallel and return the results in shard order. Called inside a
+    time_budget() block, the shard queries get what is left of it and BudgetExceeded is raised here once it runs out.
+    """
+    remaining = remaining_budget()
+    deadline = None if remaining is None else time.monotonic() + remaining
+
+    def run(alias):
+        try:
+            if deadline is None:
+                return fn(alias, *args)
+            seconds = deadline - time.monotonic()
+            if seconds <= 0:
+                raise BudgetExceeded("Time budget exceeded before the shard query started")
+            with time_budget(seconds, using=alias):
+                return fn(alias, *args)
+        finally:
+            # an idle pool thread would otherwise hold a connection to its shard (out of DB_POOL) indefinitely
+            connections[alias].close()
+
+    return list(_shard_executor().map(run, settings.ANALYTICS_SHARDS))
+
+
+def _shard_blog_counts(alias, start_date, end_date):
+    return list(
+        ShardedBlogView.objects.using(alias)
+        .filter(created_at__gte=start_date, created_at__lte=end_date)
+        .values("blog_id")
+        .annotate(z=Count("id"))
+        .values_list("blog_id", "z")
+    )
+
+
+def _shard_period_counts(alias, trunc_func, start_date, end_date, per_blog):
+    qs = (
+        ShardedBlogView.objects.using(alias)
+        .filter(created_at__gte=start_date, created_at__lte=end_date)
+        .annotate(period=trunc_func("created_at"))
+    )
+    if per_blog:
+        return list(qs.values("period", "blog_id").annotate(views_count=Count("id")).values_list("period", "blog_id", "views_count"))
+    return list(qs.values("period").annotate(views_count=Count("id"), blogs_count=Count("blog_id", distinct=True)).values_list("period", "views_count", "blogs_count"))
+
+
+def blog_view_counts(start_date, end_date):
+    # {blog_id: views in the window} over all shards, shards are disjoint by blog so the partial counts just concatenate
+    counts = {}
+    for rows in scatter(_shard_blog_counts, start_date, end_date):
+        counts.update(rows)
+    return counts
+
+
+def sharded_group_totals(blog_qs, group_field, start_date, end_date, y_field=None, per_field=None):
+    """
+    {x, y, z} rows for /blog-views/ and /top/ from the shards: per-blog view counts come from the shards, the blog ->
+    group mapping and blog filters from the default database. y is the number of blogs of the group or, with
+    `y_field`, that field of the blog. With `per_field` the rows also carry that field of the blog as `group`.
+    Sorted by views, ties by x.
+    """
+    counts = blog_view_counts(start_date, end_date)
+    fields = ["id", group_field] + ([y_field] if y_field else []) + ([per_field] if per_field else [])
+    rows = {}
+    for blog in blog_qs.values_list(*fields):
+        blog_id, x = blog[0], blog[1]
+        group = blog[-1] if per_field else None
+        row = rows.get((group, x))
+        if row is None:
+            row = rows[(group, x)] = {"x": x, "y": blog[2] if y_field else 0, "z": 0}
+            if per_field:
+                row["group"] = group
+        if not y_field:
+            row["y"] += 1
+        row["z"] += counts.get(blog_id, 0)
+    rows = list(rows.values())
+    rows.sort(key=lambda row: (-row["z"], row["x"] is None, row["x"]))
+    return rows
+
+
+def sharded_periods(trunc_func, start_date, end_date, blog_ids=None):
+    """
+    [{period, views_count, blogs_count}] for /performance/ from the shards. Without a blog filter every shard
+    returns its per-period totals and distinct blog counts add up across shards. With `blog_ids` the shards return
+    per (period, blog) counts that are filtered here.
+    """
+    views, blogs = Counter(), Counter()
+    for rows in scatter(_shard_period_counts, trunc_func, start_date, end_date, blog_ids is not None):
+        if blog_ids is None:
+            for period, views_count, blogs_count in rows:
+                views[period] += views_count
+                blogs[period] += blogs_count
+        else:
+            for period, blog_id, views_count in rows:
+                if blog_id in blog_ids:
+                    views[period] += views_count
+                    blogs[period] += 1
+    return [{"period": period, "views_count": views[period], "blogs_count": blogs[period]} for period in sorted(views)]
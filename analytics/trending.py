@@ -0,0 +1,115 @@
+import hashlib
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.db.models.functions import Trunc
+from django.utils.http import urlencode
+
+PERIODS = {"hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(weeks=1)}
+
+
+def period_start(now, granularity):
+    # Start of the period `now` falls in, the current (incomplete) period is left out of the matrix
+    start = now.replace(minute=0, second=0, microsecond=0)
+    if granularity != "hour":
+        start = start.replace(hour=0)
+    if granularity == "week":
+        start -= timedelta(days=start.weekday())
+    return start
+
+
+def count_matrix(views_qs, daily_qs, granularity, periods, end_date):
+    """
+    (blog_ids, counts) for the `periods` complete periods before `end_date`: counts[i, j] is the number of views of
+    blog_ids[i] in period j, oldest first. Built from one grouped query (plus one over the compacted days), only
+    blogs with views in the window get a row.
+    """
+    delta = PERIODS[granularity]
+    start_date = end_date - delta * periods
+    buckets = {start_date + delta * i: i for i in range(periods)}
+
+    rows = [
+        (blog_id, buckets[bucket], views)
+        for blog_id, bucket, views in views_qs.filter(created_at__gte=start_date, created_at__lt=end_date)
+        .annotate(bucket=Trunc("created_at", granularity))
+        .values("blog_id", "bucket")
+        .annotate(views=Count("id"))
+        .values_list("blog_id", "bucket", "views")
+        .order_by()
+    ]
+    if daily_qs is not None and granularity != "hour":
+        # compacted days only have day granularity, they can't be split into hours. Truncating a date gives a date.
+        day_buckets = {bucket.date(): i for bucket, i in buckets.items()}
+        rows += [
+            (blog_id, day_buckets[bucket], views)
+            for blog_id, bucket, views in daily_qs.filter(day__gte=start_date.date(), day__lt=end_date.date())
+            .annotate(bucket=Trunc("day", granularity))
+            .values("blog_id", "bucket")
+            .annotate(views=Sum("views"))
+            .values_list("blog_id", "bucket", "views")
+            .order_by()
+        ]
+
+    blog_column = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    bucket_column = np.fromiter((row[1] for row in rows), dtype=np.int32, count=len(rows))
+    views_column = np.fromiter((row[2] for row in rows), dtype=np.int32, count=len(rows))
+
+    blog_ids, blog_index = np.unique(blog_column, return_inverse=True)
+    counts = np.zeros((len(blog_ids), periods), dtype=np.int32)
+    np.add.at(counts, (blog_index, bucket_column), views_column)
+    return blog_ids, counts
+
+
+def cached_count_matrix(views_qs, daily_qs, granularity, periods, end_date, filters):
+    # The matrix only changes when a new period starts, the key includes the period so it rolls over by itself
+    digest = hashlib.md5(urlencode(sorted(filters.items())).encode()).hexdigest()
+    key = f"analytics:trending:{granularity}:{periods}:{end_date.isoformat()}:{digest}"
+    matrix = cache.get(key)
+    if matrix is None:
+        matrix = count_matrix(views_qs, daily_qs, granularity, periods, end_date)
+        cache.set(key, matrix, settings.ANALYTICS_TRENDING_CACHE_TIMEOUT)
+    return matrix
+
+
+def score(counts, recent=1, half_life=2.0):
+    """
+    Trend scores of every row of a (blogs x periods) count matrix at once, the last `recent` periods against the
+    ones before them (the baseline):
+      growth  - recent views per period over baseline views per period, both +1 smoothed, minus 1
+      zscore  - how many baseline standard deviations (at least sqrt(mean), Poisson noise, and 1) the recent rate
+                is above the baseline mean
+      decayed - views per period with exponentially decaying weights, halving every `half_life` periods back
+      score   - zscore * log1p(decayed), significant and sizeable rises first
+    """
+    counts = counts.astype(np.float64, copy=False)
+    baseline, current = counts[:, :-recent], counts[:, -recent:]
+    baseline_mean = baseline.mean(axis=1)
+    recent_mean = current.mean(axis=1)
+
+    growth = (recent_mean + 1) / (baseline_mean + 1) - 1
+    sigma = np.maximum(np.sqrt(np.maximum(baseline.var(axis=1), baseline_mean)), 1.0)
+    zscore = (recent_mean - baseline_mean) / sigma
+
+    ages = np.arange(counts.shape[1] - 1, -1, -1, dtype=np.float64)
+    weights = 0.5 ** (ages / half_life)
+    decayed = counts @ weights / weights.sum()
+
+    return {
+        "score": zscore * np.log1p(decayed),
+        "growth": growth,
+        "zscore": zscore,
+        "decayed": decayed,
+        "recent": current.sum(axis=1),
+        "baseline": baseline_mean,
+    }
+
+
+def top_movers(scores, n, min_views=0):
+    # Row indexes of the n highest scores, best first, among rows with at least `min_views` recent views
+    candidates = np.flatnonzero(scores["recent"] >= min_views)
+    if len(candidates) > n:
+        candidates = candidates[np.argpartition(-scores["score"][candidates], n - 1)[:n]]
+    return candidates[np.argsort(-scores["score"][candidates], kind="stable")]
@@ -7,4 +7,10 @@ urlpatterns = [
     path('blog-views/', views.BlogViewsAnalytics.as_view(), name='blog_views'),
     path('top/', views.TopListAnalytics.as_view(), name='top_blog'),
     path('performance/', views.PerformanceAnalytics.as_view(), name='user_performance'),
+    path('live/', views.LiveAnalytics.as_view(), name='live'),
+    path('cube/', views.CubeAnalytics.as_view(), name='cube'),
+    path('trending/', views.TrendingAnalytics.as_view(), name='trending'),
+    path('views/', views.RecordBlogView.as_view(), name='record_view'),
+    path('jobs/<uuid:job_id>/', views.AnalyticsJobStatus.as_view(), name='job'),
+    path('budgets/', views.AnalyticsBudgets.as_view(), name='budgets'),
 ]
@@ -1,33 +1,246 @@
+import hashlib
+import json
+import logging
+import operator
+from functools import reduce
+
 from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from django.utils import timezone
-from django.db.models import Count, Q, F
+from django.db.models import Count, F, OuterRef, Q, QuerySet, Subquery, Sum, Window
+from django.db.models.functions import Coalesce, Rank, RowNumber
 from django.db.models.functions import TruncMonth, TruncWeek, TruncDay, TruncYear
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import serializers
+from rest_framework.fields import empty
+from rest_framework.exceptions import APIException, PermissionDenied
 from django_filters import rest_framework as filters
 
-from analytics.models import BlogView
+from analytics.budget import BudgetExceeded, budget_hits, count_budget_hit, endpoint_budget, sample_windows, time_budget
+from analytics.columnar import columnar_engine, columnar_ready
+from analytics.cube import DIMENSIONS, cube, grouping_sets, sharded_cube
+from analytics.explain import explain_request
+from analytics.ingest import record_view
+from analytics.jobs import enqueue
+from analytics.live import merged_snapshots, top_live, dedup_totals
+from analytics.models import AnalyticsJob, BlogView, BlogViewDaily
+from analytics.retention import compacted_daily, merge_compacted_periods
 from analytics.serializers import BaseAnalyticsInputSerializer
+from analytics.sharding import sharding_enabled, sharded_group_totals, sharded_periods
+from analytics.trending import PERIODS as TRENDING_PERIODS, cached_count_matrix, period_start, score as trend_scores, top_movers
 from blogs.models import Blog
 
+logger = logging.getLogger("django")
+
+
+def as_columns(rows, fields=('x', 'y', 'z')):
+    # Columnar data ({"x": [...], "y": [...], "z": [...]}) from a values() queryset without building a dict per row,
+    # lists of dicts (merged or computed in Python) are transposed as they are
+    if isinstance(rows, QuerySet):
+        rows = rows.values_list(*fields)
+    else:
+        rows = [tuple(row[field] for field in fields) for row in rows]
+    columns = list(zip(*rows)) or [()] * len(fields)
+    return {field: list(column) for field, column in zip(fields, columns)}
+
+
+def with_view_counts(qs, start_date, end_date, sample=None):
+    """
+    First phase of the /blog-views/ and /top/ aggregation: annotate every blog of `qs` with its views in the window
+    (view_count), counted per blog by a correlated subquery on the (blog, created_at) index. Grouping blogs on top
+    of that never joins the view rows to their blogs, so there is no fan-out for a DISTINCT to undo.
+    Views of compacted days (BlogViewDaily) are added the same way.
+    With `sample` the raw views are only counted in 1/sample of the window (sample_windows) and scaled up.
+    """
+    window = Q(created_at__gte=start_date, created_at__lte=end_date)
+    if sample:
+        window = reduce(operator.or_, (Q(created_at__gte=start, created_at__lt=end) for start, end in sample_windows(start_date, end_date, sample)))
+    raw_views = (
+        BlogView.objects
+        .filter(window, blog=OuterRef('pk'))
+        .order_by().values('blog').annotate(count=Count('*')).values('count')
+    )
+    view_count = Coalesce(Subquery(raw_views), 0)
+    if sample:
+        view_count = view_count * sample
+
+    # Views older than the retention period only exist as per-day aggregates
+    daily = compacted_daily(start_date, end_date)
+    if daily is not None:
+        daily_views = daily.filter(blog=OuterRef('pk')).order_by().values('blog').annotate(total=Sum('views')).values('total')
+        view_count = view_count + Coalesce(Subquery(daily_views), 0)
+
+    return qs.annotate(view_count=view_count)
+
+
+def viewer_country_totals(blog_qs, start_date, end_date):
+    """
+    {x, y, z} rows per viewer country (BlogView.viewer_country): views of the blogs of `blog_qs` in the window and
+    how many of those blogs were viewed from the country. Views are grouped directly, a blog has views from many countries.
+    """
+    if sharding_enabled():
+        raise serializers.ValidationError("Viewer countries are not stored in the sharded views.")
+    views = BlogView.objects.filter(created_at__gte=start_date, created_at__lte=end_date, blog__in=blog_qs)
+    daily = compacted_daily(start_date, end_date)
+    if daily is not None:
+        daily = daily.filter(blog__in=blog_qs)
+    rows = cube(views, daily, ['viewer_country'], None, [['viewer_country']])
+    return [{'x': row['viewer_country'], 'y': row['blogs'], 'z': row['views']} for row in rows]
+
+
+def rank_within_groups(rows, n, ties=True):
+    """
+    Python counterpart of the RANK()/ROW_NUMBER() window of /top/?per=, for the rows merged from the shards.
+    Keeps the n first rows by views of every group, with ties all rows tied with the n-th one.
+    """
+    groups = {}
+    for row in sorted(rows, key=lambda row: (-row['z'], row['x'] is None, row['x'])):
+        groups.setdefault(row['group'], []).append(row)
+
+    ranked = []
+    for group in sorted(groups, key=lambda group: (group is None, group)):
+        for position, row in enumerate(groups[group], start=1):
+            rank = position
+            if ties and position > 1 and row['z'] == ranked[-1]['z']:
+                rank = ranked[-1]['rank']
+            if rank > n:
+                break
+            ranked.append({**row, 'rank': rank})
+    return ranked
+
+
+class BudgetExhausted(APIException):
+    status_code = 503
+    default_detail = "The query took too long and there is no earlier result to serve. Retry with async=1 to run it in the background."
+    default_code = 'time_budget_exceeded'
+
+
+class AnalyticsAPIView(APIView):
+    # Shared plumbing for the analytics endpoints: the response payload is built by compute() from the raw
+    # query params and cached per (endpoint, params), so identical dashboard requests hit the DB only once per timeout.
+    endpoint = None
+    sampled = False  # compute() takes `sample`, counting the views per blog with with_view_counts()
+
+    def get(self, request):
+        if request.query_params.get('explain') in ('1', 'true'):
+            return self.get_explained(request)
+        if request.query_params.get('async') in ('1', 'true'):
+            return self.get_async(request)
+        return Response(self.get_cached(request.query_params))
+
+    def get_async(self, request):
+        # ?async=1 - queue the request for run_analytics_jobs and answer right away with the job to poll
+        query_params = request.query_params.copy()
+        del query_params['async']
+        self.InputSerializer(data=query_params).is_valid(raise_exception=True)  # reject invalid params before queueing
+
+        job = enqueue(type(self), query_params)
+        return Response({
+            'job': job.id,
+            'status': job.status,
+            'url': reverse('analytics:job', kwargs={'job_id': job.id}),
+        }, status=202)
+
+    def get_explained(self, request):
+        # ?explain=1 - staff only, bypasses the cache and returns every statement with its EXPLAIN ANALYZE plan
+        if not request.user.is_staff:
+            raise PermissionDenied("explain mode is only available to staff users.")
+        resp, report = explain_request(type(self), request.query_params)
+        return Response({**resp, 'explain': report})
+
+    @classmethod
+    def cache_key(cls, query_params):
+        # Keyed on the validated params with their defaults, so /blog-views/ and /blog-views/?range=year share an
+        # entry. Dates derived from range/compare are left out, they move with every request.
+        serializer = cls.InputSerializer(data=query_params)
+        serializer.is_valid(raise_exception=True)
+        params = {
+            name: value for name, value in serializer.validated_data.items()
+            if name in serializer.fields and (name in query_params or serializer.fields[name].default is not empty)
+        }
+        params.update((name, query_params[name]) for name in cls.InputFilterSet.base_filters if query_params.get(name))
+        params['format'] = query_params.get('format')
+        digest = hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+        return f"analytics:{cls.endpoint}:{digest}"
+
+    def get_cached(self, query_params, budget=None, degrade=True):
+        # The warm-up passes what is left of its own budget instead of the endpoint's and, with degrade=False, gets
+        # BudgetExceeded instead of a stale or approximate response cached in place of the exact one
+        budget = endpoint_budget(self.endpoint) if budget is None else budget
+        key = self.cache_key(query_params)
+        resp = cache.get(key)
+        if resp is None:
+            try:
+                with time_budget(budget):
+                    resp = self.compute(query_params)
+            except BudgetExceeded:
+                if not degrade:
+                    raise
+                resp = self.degraded(key, query_params, budget)
+            else:
+                # kept longer than the response itself, it is what a request that runs out of time falls back to
+                cache.set(f"{key}:stale", resp, settings.ANALYTICS_STALE_TIMEOUT)
+            cache.set(key, resp, settings.ANALYTICS_CACHE_TIMEOUT)
+        return resp
+
+    def degraded(self, key, query_params, budget):
+        # The computation ran out of its time budget: the last exact response for these params if there is one,
+        # else an estimate, else 503. Degraded responses are cached too so retries don't hold a connection again.
+        count_budget_hit(self.endpoint)
+        logger.warning(f"{self.endpoint}?{query_params.urlencode()} exceeded its time budget of {budget}s")
+
+        resp = cache.get(f"{key}:stale")
+        if resp is not None:
+            return {**resp, 'stale': True}
+        try:
+            with time_budget(budget):
+                resp = self.approximate(query_params)
+        except BudgetExceeded:
+            resp = None
+        if resp is None:
+            raise BudgetExhausted()
+        return {**resp, 'approximate': True}
+
+    def compute(self, query_params):
+        raise NotImplementedError
+
+    def approximate(self, query_params):
+        # Cheaper estimate of compute() used when it runs out of time, None when the endpoint has none: raw views
+        # counted in 1/ANALYTICS_APPROXIMATE_SAMPLE of the window and scaled up, see with_view_counts()
+        if not self.sampled or sharding_enabled() or 'viewer_country' in (query_params.get('object_type'), query_params.get('top')):
+            return None
+        return self.compute(query_params, sample=settings.ANALYTICS_APPROXIMATE_SAMPLE)
+
+    @staticmethod
+    def is_columnar(query_params):
+        # ?format=columnar is also what makes DRF pick the ColumnarRenderer
+        return query_params.get('format') == 'columnar'
+
 
 # API #1 - /analytics/blog-views/
-class BlogViewsAnalytics(APIView):
+class BlogViewsAnalytics(AnalyticsAPIView):
+    endpoint = '/analytics/blog-views/'
+    sampled = True
+
     class InputSerializer(BaseAnalyticsInputSerializer):
-        object_type = serializers.ChoiceField(choices=["user", "country"], default="user")
+        object_type = serializers.ChoiceField(choices=["user", "country", "viewer_country"], default="user")
 
     class InputFilterSet(filters.FilterSet):
         title = filters.CharFilter(lookup_expr="icontains")
-        author = filters.CharFilter(field_name="author__name", lookup_expr="icontains")
+        author = filters.CharFilter(field_name="author__username", lookup_expr="icontains")
         country = filters.CharFilter(field_name="author__country__name", lookup_expr="icontains")
 
         class Meta:
             model = Blog
             fields = ["title", "author", "country"]
 
-    def get(self, request):
-        serializer = self.InputSerializer(data=request.query_params)
+    def compute(self, query_params, sample=None):
+        serializer = self.InputSerializer(data=query_params)
         serializer.is_valid(raise_exception=True)
         params = serializer.validated_data
 
@@ -43,9 +256,9 @@ class BlogViewsAnalytics(APIView):
             qs = qs.filter(created_at__gte=start_date, created_at__lte=end_date)
 
         # Dynamic filtering based on additional user query params
-        filterset = self.InputFilterSet(request.query_params, queryset=qs)
+        filterset = self.InputFilterSet(query_params, queryset=qs)
         if not filterset.is_valid():
-            return Response(filterset.errors, status=400)
+            raise serializers.ValidationError(filterset.errors)
         qs = filterset.qs
 
         if object_type == 'country':
@@ -53,48 +266,70 @@ class BlogViewsAnalytics(APIView):
         else:
             group_field = 'author__username'
 
-        data = (
-            qs
-            .values(x=F(group_field))
-            .annotate(
-                y=Count('id', distinct=True),
-                z=Count('views', filter=Q(views__created_at__gte=start_date, views__created_at__lte=end_date))
+        if object_type == 'viewer_country':
+            # Grouped by where the views come from instead of by the blogs' authors, y counts the blogs viewed
+            data = viewer_country_totals(qs, start_date, end_date)
+        elif sharding_enabled():
+            # Views are spread over the shard databases, aggregate them per blog there and roll up here
+            data = sharded_group_totals(qs, group_field, start_date, end_date)
+        elif columnar_ready():
+            # Counted on the in-memory view columns of this worker, see ColumnarEngine
+            data = columnar_engine.group_totals(qs, group_field, start_date, end_date)
+        else:
+            # Second phase: roll the per-blog view counts up to the user or country
+            data = (
+                with_view_counts(qs, start_date, end_date, sample)
+                .values(x=F(group_field))
+                .annotate(y=Count('id'), z=Sum('view_count'))
+                .order_by('-z', 'x')
             )
-            .order_by('-z')
-        )
 
         resp = {
             'endpoint': '/analytics/blog-views/',
             'object_type': object_type,
             'start_date': start_date,
             'end_date': end_date,
-            'labels': "X = Object (User/Country), Y = Total Blogs, Z = Total Views",
-            'data': data
+            'labels': "X = Viewer Country, Y = Blogs Viewed, Z = Total Views" if object_type == 'viewer_country' else "X = Object (User/Country), Y = Total Blogs, Z = Total Views",
+            'data': as_columns(data) if self.is_columnar(query_params) else list(data)
         }
 
-        return Response(resp)
+        return resp
 
 
 # API #2 - /analytics/top/
-class TopListAnalytics(APIView):
+class TopListAnalytics(AnalyticsAPIView):
+    endpoint = '/analytics/top/'
+    sampled = True
+
     class InputSerializer(BaseAnalyticsInputSerializer):
-        top = serializers.ChoiceField(choices=["user", "country", "blog"], default="user")
+        top = serializers.ChoiceField(choices=["user", "country", "blog", "viewer_country"], default="user")
+        per = serializers.ChoiceField(choices=["user", "country"], required=False)  # top n within each user/country
+        n = serializers.IntegerField(min_value=1, max_value=100, default=10)
+        ties = serializers.BooleanField(default=True)  # with per: keep every row tied with the n-th one (RANK) or exactly n (ROW_NUMBER)
+
+        def validate(self, attrs):
+            per = attrs.get("per")
+            if per and (per == attrs["top"] or (attrs["top"], per) in (("country", "user"), ("viewer_country", "user"), ("viewer_country", "country"))):
+                raise serializers.ValidationError(f"top={attrs['top']} cannot be grouped per {per}.")
+            return super().validate(attrs)
 
     class InputFilterSet(filters.FilterSet):
         title = filters.CharFilter(lookup_expr="icontains")
-        author = filters.CharFilter(field_name="author__name", lookup_expr="icontains")
+        author = filters.CharFilter(field_name="author__username", lookup_expr="icontains")
         country = filters.CharFilter(field_name="author__country__name", lookup_expr="icontains")
 
         class Meta:
             model = Blog
             fields = ["title", "author", "country"]
 
-    def get(self, request):
-        serializer = self.InputSerializer(data=request.query_params)
+    def compute(self, query_params, sample=None):
+        serializer = self.InputSerializer(data=query_params)
         serializer.is_valid(raise_exception=True)
         params = serializer.validated_data
 
         top_type = params["top"]
+        per = params.get("per")
+        n = params["n"]
         start_date = params["start_date"]
         end_date = params["end_date"]
         filter_blog_creation = params["filter_blog_creation"]
@@ -106,9 +341,9 @@ class TopListAnalytics(APIView):
         if filter_blog_creation:
             qs = qs.filter(created_at__gte=start_date, created_at__lte=end_date)
 
-        filterset = self.InputFilterSet(request.query_params, queryset=qs)
+        filterset = self.InputFilterSet(query_params, queryset=qs)
         if not filterset.is_valid():
-            return Response(filterset.errors, status=400)
+            raise serializers.ValidationError(filterset.errors)
         qs = filterset.qs
 
         # We define the x, y, and z based on the 'top' type
@@ -120,35 +355,72 @@ class TopListAnalytics(APIView):
             group_field = 'author__country__name'
             x_label = 'Country Name'
             y_label = 'Blogs in Country'
+        elif top_type == 'viewer_country':
+            group_field = None
+            x_label = 'Viewer Country'
+            y_label = 'Blogs Viewed'
         else:  # top_type == 'blog'
             group_field = 'id'
             x_label = 'Blog ID'
             y_label = 'Blog Title'
 
-        data = (
-            qs
-            .values(x=F(group_field))  # Group by the selected field (User, Country, or Title)
-            .annotate(
-                y=Count('id', distinct=True) if top_type != 'blog' else F('title'),
-                z=Count('views', filter=Q(views__created_at__gte=start_date, views__created_at__lte=end_date))
+        per_field = {'user': 'author__username', 'country': 'author__country__name'}.get(per)
+        columnar = columnar_ready()  # decided once, the ranking below depends on who counted
+
+        if top_type == 'viewer_country':
+            data = viewer_country_totals(qs, start_date, end_date)
+        elif sharding_enabled():
+            # Groups span shards, so the top n can only be cut after the per-blog counts of all shards are rolled up
+            data = sharded_group_totals(qs, group_field, start_date, end_date, y_field='title' if top_type == 'blog' else None, per_field=per_field)
+        elif columnar:
+            # Counted, ranked and cut to the top n on the in-memory view columns of this worker
+            data = columnar_engine.top_totals(qs, group_field, start_date, end_date, n, per_field, params["ties"])
+        else:
+            # Per-blog view counts first, then rolled up to the selected field (User, Country, or Title)
+            data = (
+                with_view_counts(qs, start_date, end_date, sample)
+                .values(x=F(group_field), **({'group': F(per_field)} if per else {}))
+                .annotate(
+                    y=Count('id') if top_type != 'blog' else F('title'),
+                    z=Sum('view_count')
+                )
+                .order_by('-z', 'x')
+            )
+
+        if not per:
+            data = data[:n]  # Slice to return only the Top n
+        elif sharding_enabled():
+            data = rank_within_groups(data, n, params["ties"])
+        elif not columnar:
+            # Top n of every group in the same query: rank the aggregated rows within their group and keep the first n
+            data = (
+                data
+                .annotate(rank=Window(
+                    Rank() if params["ties"] else RowNumber(),
+                    partition_by=F('group'),
+                    order_by=F('z').desc() if params["ties"] else [F('z').desc(), F('x').asc()],
+                ))
+                .filter(rank__lte=n)
+                .order_by(F('group').asc(nulls_last=True), 'rank', 'x')
             )
-            .order_by('-z')
-            [:10]  # Slice the QuerySet to return only the Top 10
-        )
 
         resp = {
             'endpoint': '/analytics/top/',
             'top_type': top_type,
+            'per': per,
             'start_date': start_date,
             'end_date': end_date,
-            'labels': f"X = {x_label}, Y = {y_label}, Z = Total Views",
-            'data': data
+            'labels': f"X = {x_label}, Y = {y_label}, Z = Total Views" + (f", Group = {per.title()}, Rank = Rank in Group" if per else ""),
+            'data': as_columns(data, fields=('group', 'rank', 'x', 'y', 'z') if per else ('x', 'y', 'z')) if self.is_columnar(query_params) else list(data)
         }
 
-        return Response(resp)
+        return resp
 
 
-class PerformanceAnalytics(APIView):
+# API #3 - /analytics/performance/
+class PerformanceAnalytics(AnalyticsAPIView):
+    endpoint = '/analytics/performance/'
+
     class InputSerializer(serializers.Serializer):
         compare = serializers.ChoiceField(choices=["day", "week", "month", "year"], default="month")
         user = serializers.CharField(required=False)  # Optional field to filter results for a single user
@@ -176,15 +448,42 @@ class PerformanceAnalytics(APIView):
 
     class InputFilterSet(filters.FilterSet):
         title = filters.CharFilter(field_name="blog__title", lookup_expr="icontains")
-        author = filters.CharFilter(field_name="blog__author__name", lookup_expr="icontains")
+        author = filters.CharFilter(field_name="blog__author__username", lookup_expr="icontains")
         country = filters.CharFilter(field_name="blog__author__country__name", lookup_expr="icontains")
 
         class Meta:
             model = BlogView
             fields = ["title", "author", "country"]
 
-    def get(self, request):
-        serializer = self.InputSerializer(data=request.query_params)
+    class BlogFilterSet(filters.FilterSet):
+        title = filters.CharFilter(lookup_expr="icontains")
+        author = filters.CharFilter(field_name="author__username", lookup_expr="icontains")
+        country = filters.CharFilter(field_name="author__country__name", lookup_expr="icontains")
+
+        class Meta:
+            model = Blog
+            fields = ["title", "author", "country"]
+
+    class DailyFilterSet(InputFilterSet):
+        # Same filters over the compacted per-day aggregates
+        class Meta:
+            model = BlogViewDaily
+            fields = ["title", "author", "country"]
+
+    def filtered_blog_ids(self, query_params, user):
+        # Ids of the blogs matching the user/dynamic filters or None when there is nothing to filter on
+        if not user and not any(query_params.get(name) for name in self.BlogFilterSet.base_filters):
+            return None
+        qs = Blog.objects.all()
+        if user:
+            qs = qs.filter(author__username=user)
+        filterset = self.BlogFilterSet(query_params, queryset=qs)
+        if not filterset.is_valid():
+            raise serializers.ValidationError(filterset.errors)
+        return set(filterset.qs.values_list('id', flat=True))
+
+    def compute(self, query_params):
+        serializer = self.InputSerializer(data=query_params)
         serializer.is_valid(raise_exception=True)
         params = serializer.validated_data
 
@@ -195,28 +494,43 @@ class PerformanceAnalytics(APIView):
 
         TruncFunc = {'month': TruncMonth, 'week': TruncWeek, 'day': TruncDay, 'year': TruncYear}.get(compare, TruncMonth)
 
-        qs = BlogView.objects.filter(created_at__gte=start_date, created_at__lte=end_date)
-        if user:
-            qs = qs.filter(blog__author__username=user)
+        if sharding_enabled():
+            # Views are spread over the shard databases, blog filters are resolved here against the Blog table
+            period_data = sharded_periods(TruncFunc, start_date, end_date, self.filtered_blog_ids(query_params, user))
+        elif columnar_ready():
+            period_data = columnar_engine.periods(compare, start_date, end_date, self.filtered_blog_ids(query_params, user))
+        else:
+            qs = BlogView.objects.filter(created_at__gte=start_date, created_at__lte=end_date)
+            if user:
+                qs = qs.filter(blog__author__username=user)
+
+            # Apply dynamic filters
+            filterset = self.InputFilterSet(query_params, queryset=qs)
+            if not filterset.is_valid():
+                raise serializers.ValidationError(filterset.errors)
+            qs = filterset.qs
+
+            # Aggregate per period
+            period_qs = (
+                qs.annotate(period=TruncFunc('created_at'))
+                .values('period')
+                .annotate(
+                    views_count=Count('id'),
+                    blogs_count=Count('blog', distinct=True)
+                )
+                .order_by('period')
+            )
 
-        # Apply dynamic filters
-        filterset = self.InputFilterSet(request.query_params, queryset=qs)
-        if not filterset.is_valid():
-            return Response(filterset.errors, status=400)
-        qs = filterset.qs
+            period_data = list(period_qs)
 
-        # Aggregate per period
-        period_qs = (
-            qs.annotate(period=TruncFunc('created_at'))
-            .values('period')
-            .annotate(
-                views_count=Count('id'),
-                blogs_count=Count('blog', distinct=True)
-            )
-            .order_by('period')
-        )
+            # Views older than the retention period only exist as per-day aggregates
+            daily = compacted_daily(start_date, end_date)
+            if daily is not None:
+                if user:
+                    daily = daily.filter(blog__author__username=user)
+                daily = self.DailyFilterSet(query_params, queryset=daily).qs
+                period_data = merge_compacted_periods(period_data, qs, daily, TruncFunc)
 
-        period_data = list(period_qs)
         date_format = {"day": "%b %d", "week": "Week %W", "month": "%b %Y", "year": "%Y"}.get(compare, "%Y")
 
         # Implementing this using only queryset functions was very problematic.
@@ -243,6 +557,233 @@ class PerformanceAnalytics(APIView):
             'start_date': start_date,
             'end_date': end_date,
             'labels': "X = Period & Blogs Created, Y = Total Views, Z = Growth %",
-            'data': final_data
+            'data': as_columns(final_data) if self.is_columnar(query_params) else final_data
+        }
+        return resp
+
+
+# API #5 - /analytics/cube/
+class CubeAnalytics(AnalyticsAPIView):
+    endpoint = '/analytics/cube/'
+
+    class InputSerializer(BaseAnalyticsInputSerializer):
+        dimensions = serializers.CharField(default="country,user")  # comma separated, in drill-down order
+        granularity = serializers.ChoiceField(choices=["day", "week", "month", "year"], default="month")  # of the period dimension
+        sets = serializers.ChoiceField(choices=["rollup", "cube"], default="rollup")
+
+        def validate_dimensions(self, value):
+            dimensions = [dim.strip() for dim in value.split(",") if dim.strip()]
+            invalid = [dim for dim in dimensions if dim not in DIMENSIONS]
+            if invalid:
+                raise serializers.ValidationError(f"Unknown dimensions {', '.join(invalid)}, choose from {', '.join(DIMENSIONS)}.")
+            if not dimensions or len(set(dimensions)) != len(dimensions):
+                raise serializers.ValidationError("Provide each dimension at most once.")
+            return dimensions
+
+    # Same filters as /analytics/performance/, on the views, the compacted days and the blogs
+    InputFilterSet = PerformanceAnalytics.InputFilterSet
+    DailyFilterSet = PerformanceAnalytics.DailyFilterSet
+    BlogFilterSet = PerformanceAnalytics.BlogFilterSet
+
+    def filtered(self, filterset_class, query_params, qs):
+        filterset = filterset_class(query_params, queryset=qs)
+        if not filterset.is_valid():
+            raise serializers.ValidationError(filterset.errors)
+        return filterset.qs
+
+    def compute(self, query_params):
+        serializer = self.InputSerializer(data=query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        dimensions = params["dimensions"]
+        granularity = params["granularity"]
+        start_date = params["start_date"]
+        end_date = params["end_date"]
+        sets = grouping_sets(dimensions, params["sets"])
+
+        # If filter_blog_creation is true, only views of the blogs created in the window count
+        blog_window = {'created_at__gte': start_date, 'created_at__lte': end_date} if params["filter_blog_creation"] else {}
+
+        if sharding_enabled():
+            if 'viewer_country' in dimensions:
+                raise serializers.ValidationError("Viewer countries are not stored in the sharded views.")
+            blogs = self.filtered(self.BlogFilterSet, query_params, Blog.objects.filter(**blog_window))
+            data = sharded_cube(blogs, dimensions, granularity, start_date, end_date, sets)
+        else:
+            qs = BlogView.objects.filter(created_at__gte=start_date, created_at__lte=end_date, **{f'blog__{k}': v for k, v in blog_window.items()})
+            qs = self.filtered(self.InputFilterSet, query_params, qs)
+
+            # Views older than the retention period only exist as per-day aggregates
+            daily = compacted_daily(start_date, end_date)
+            if daily is not None:
+                daily = self.filtered(self.DailyFilterSet, query_params, daily.filter(**{f'blog__{k}': v for k, v in blog_window.items()}))
+            data = cube(qs, daily, dimensions, granularity, sets)
+
+        resp = {
+            'endpoint': self.endpoint,
+            'dimensions': dimensions,
+            'granularity': granularity,
+            'sets': sets,
+            'start_date': start_date,
+            'end_date': end_date,
+            'labels': "set = Dimensions of the subtotal (the others are rolled up), views = Total Views, blogs = Blogs Viewed",
+            'data': as_columns(data, fields=('set', *dimensions, 'views', 'blogs')) if self.is_columnar(query_params) else data
+        }
+        return resp
+
+
+# API #6 - /analytics/trending/
+class TrendingAnalytics(AnalyticsAPIView):
+    endpoint = '/analytics/trending/'
+
+    class InputSerializer(serializers.Serializer):
+        granularity = serializers.ChoiceField(choices=list(TRENDING_PERIODS), default="day")
+        periods = serializers.IntegerField(min_value=3, max_value=168, default=14)  # complete periods in the matrix
+        recent = serializers.IntegerField(min_value=1, default=1)  # last periods scored against the ones before them
+        half_life = serializers.FloatField(min_value=0.1, default=2.0)  # in periods
+        n = serializers.IntegerField(min_value=1, max_value=100, default=10)
+        min_views = serializers.IntegerField(min_value=0, default=3)  # in the recent periods, keeps out noise from 0 -> 1 views
+
+        def validate(self, attrs):
+            if attrs["recent"] >= attrs["periods"]:
+                raise serializers.ValidationError("recent must be smaller than periods, the rest is the baseline.")
+            return attrs
+
+    InputFilterSet = PerformanceAnalytics.InputFilterSet
+    DailyFilterSet = PerformanceAnalytics.DailyFilterSet
+
+    def compute(self, query_params):
+        serializer = self.InputSerializer(data=query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        if sharding_enabled():
+            raise serializers.ValidationError("Trending is not available with sharded views.")
+
+        granularity = params["granularity"]
+        periods = params["periods"]
+        end_date = period_start(timezone.now(), granularity)
+        start_date = end_date - TRENDING_PERIODS[granularity] * periods
+
+        filterset = self.InputFilterSet(query_params, queryset=BlogView.objects.all())
+        if not filterset.is_valid():
+            raise serializers.ValidationError(filterset.errors)
+        daily = compacted_daily(start_date, end_date)
+        if daily is not None:
+            daily = self.DailyFilterSet(query_params, queryset=daily).qs
+        filters = {name: query_params[name] for name in self.InputFilterSet.base_filters if query_params.get(name)}
+
+        blog_ids, counts = cached_count_matrix(filterset.qs, daily, granularity, periods, end_date, filters)
+        scores = trend_scores(counts, recent=params["recent"], half_life=params["half_life"])
+        top = top_movers(scores, params["n"], params["min_views"])
+
+        titles = Blog.objects.in_bulk([int(blog_ids[i]) for i in top])
+        data = [
+            {
+                'x': int(blog_ids[i]),
+                'y': titles[int(blog_ids[i])].title if int(blog_ids[i]) in titles else None,
+                'z': round(float(scores['score'][i]), 3),
+                'growth': round(float(scores['growth'][i]), 3),
+                'zscore': round(float(scores['zscore'][i]), 3),
+                'decayed': round(float(scores['decayed'][i]), 3),
+                'recent': int(scores['recent'][i]),
+                'baseline': round(float(scores['baseline'][i]), 3),
+            }
+            for i in top
+        ]
+
+        resp = {
+            'endpoint': self.endpoint,
+            'granularity': granularity,
+            'periods': periods,
+            'recent': params['recent'],
+            'start_date': start_date,
+            'end_date': end_date,
+            'labels': "X = Blog ID, Y = Blog Title, Z = Trend Score (zscore * log(1 + decayed views per period))",
+            'data': as_columns(data, fields=('x', 'y', 'z', 'growth', 'zscore', 'decayed', 'recent', 'baseline')) if self.is_columnar(query_params) else data
+        }
+        return resp
+
+
+# POST /analytics/views/ - ingestion path for blog views
+class RecordBlogView(APIView):
+    class InputSerializer(serializers.Serializer):
+        blog = serializers.IntegerField()
+
+    def post(self, request):
+        serializer = self.InputSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        blog = get_object_or_404(Blog.objects.select_related('author', 'author__country'), pk=serializer.validated_data['blog'])
+        ip_address = request.META.get(getattr(settings, 'RATELIMIT_IP_META_KEY', 'REMOTE_ADDR'))
+        view = record_view(blog, ip_address=ip_address)
+        if view is None:
+            return Response({'id': None, 'blog': blog.id, 'duplicate': True}, status=200)
+
+        return Response({'id': view.id, 'blog': blog.id, 'created_at': view.created_at, 'duplicate': False}, status=201)
+
+
+# API #4 - /analytics/live/
+class LiveAnalytics(APIView):
+    # Served from the in-memory per-minute counters, never touches the database and is never cached
+    class InputSerializer(serializers.Serializer):
+        minutes = serializers.IntegerField(min_value=1, max_value=settings.ANALYTICS_LIVE_WINDOW, default=5)
+        n = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+    def get(self, request):
+        serializer = self.InputSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        end_date = timezone.now()
+        snapshots = merged_snapshots()
+        resp = {
+            'endpoint': '/analytics/live/',
+            'minutes': params['minutes'],
+            'start_date': end_date - relativedelta(minutes=params['minutes']),
+            'end_date': end_date,
+            'labels': "X = Object (Blog ID/User/Country), Y = Blog Title, Z = Total Views",
+            'data': top_live(snapshots, params['minutes'], params['n']),
+            'dedup': dedup_totals(snapshots),
         }
         return Response(resp)
+
+
+# GET /analytics/jobs/<id>/ - result of a request queued with ?async=1
+class AnalyticsJobStatus(APIView):
+    def get(self, request, job_id):
+        job = get_object_or_404(AnalyticsJob, id=job_id)
+        if job.expires_at and job.expires_at <= timezone.now():
+            raise Http404
+
+        resp = {
+            'job': job.id,
+            'endpoint': job.endpoint,
+            'query': job.query_string,
+            'status': job.status,
+            'created_at': job.created_at,
+            'finished_at': job.finished_at,
+        }
+        if job.status == AnalyticsJob.DONE:
+            resp['result'] = job.result
+        elif job.status == AnalyticsJob.FAILED:
+            resp['error'] = job.error
+        return Response(resp)
+
+
+# GET /analytics/budgets/ - time budget of every analytics endpoint and how many requests ran out of it
+class AnalyticsBudgets(APIView):
+    def get(self, request):
+        if not request.user.is_staff:
+            raise PermissionDenied("Budget counters are only available to staff users.")
+        endpoints = sorted(analytics_views())
+        hits = budget_hits(endpoints)
+        return Response({
+            'data': [{'endpoint': endpoint, 'budget': endpoint_budget(endpoint), 'hits': hits[endpoint]} for endpoint in endpoints],
+        })
+
+
+def analytics_views():
+    # {endpoint: view class} of the cached analytics endpoints, used by the background job workers
+    return {view_cls.endpoint: view_cls for view_cls in AnalyticsAPIView.__subclasses__()}
@@ -0,0 +1,93 @@
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from django.db import connections
+from django.http import QueryDict
+
+from analytics.budget import BudgetExceeded, endpoint_budget
+from analytics.columnar import columnar_enabled, columnar_engine
+from analytics.views import BlogViewsAnalytics, TopListAnalytics, PerformanceAnalytics
+
+logger = logging.getLogger("analytics")
+
+
+# The parameter combinations the dashboard hits right after a deploy, per endpoint view
+WARMUP_MATRIX = [
+    (BlogViewsAnalytics, {"range": ["week", "month", "year"], "object_type": ["user", "country"]}),
+    (TopListAnalytics, {"range": ["week", "month", "year"], "top": ["user", "country", "blog"]}),
+    (PerformanceAnalytics, {"compare": ["day", "week", "month", "year"]}),
+]
+
+
+def iter_warmup_queries():
+    for view_cls, matrix in WARMUP_MATRIX:
+        keys = list(matrix)
+        for values in itertools.product(*(matrix[key] for key in keys)):
+            query_params = QueryDict(mutable=True)
+            query_params.update(dict(zip(keys, values)))
+            yield view_cls, query_params
+
+
+def _warm_one(view_cls, query_params, deadline):
+    # Queries that have not started before the deadline are skipped, the running ones are interrupted at it
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        return "skipped", 0.0
+    budget = endpoint_budget(view_cls.endpoint)
+    started = time.monotonic()
+    try:
+        view_cls().get_cached(query_params, budget=min(remaining, budget) if budget else remaining, degrade=False)
+        return "warmed", time.monotonic() - started
+    except BudgetExceeded:
+        return "timed out", time.monotonic() - started
+    finally:
+        # every pool thread opens its own connection, don't leak them into the forked workers
+        connections.close_all()
+
+
+def warm_up(budget=10.0, threads=4, grace=5.0):
+    """
+    Precompute the common analytics responses into the cache.
+
+    Runs the queries of WARMUP_MATRIX in a thread pool. Queries not started within `budget` seconds are skipped and
+    the running ones are interrupted, then returns once every pool thread has exited. Returns a report entry per query.
+    """
+    if columnar_enabled():
+        # loaded before the deadline starts, in "ready" mode the forked workers share the arrays copy-on-write
+        started = time.monotonic()
+        columnar_engine.refresh()
+        stats = columnar_engine.stats()
+        logger.info(f"Columnar engine: {stats['views']} views loaded in {time.monotonic() - started:.1f}s ({stats['bytes'] / 2 ** 20:.0f} MB)")
+
+    deadline = time.monotonic() + budget
+    queries = list(iter_warmup_queries())
+    report = []
+
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="analytics-warmup")
+    futures = {executor.submit(_warm_one, view_cls, params, deadline): (view_cls, params) for view_cls, params in queries}
+    wait(futures, timeout=budget)
+    executor.shutdown(wait=False, cancel_futures=True)
+    # The time budget ends the running queries at the deadline, but not the Python work around them. In "ready" mode
+    # the workers are forked right after, and a thread still running would leave the cache and logging locks it holds
+    # locked in every worker, so the pool threads are always joined; `grace` only bounds the wait before the warning.
+    if wait(futures, timeout=grace).not_done:
+        logger.warning(f"Analytics warm-up: queries still running {grace:.0f}s after the deadline, waiting for them")
+    executor.shutdown(wait=True)
+
+    for future, (view_cls, params) in futures.items():
+        label = f"{view_cls.endpoint}?{params.urlencode()}"
+        if future.cancelled():
+            status, took = "skipped", 0.0
+        elif future.exception() is not None:
+            status, took = f"failed: {future.exception()}", 0.0
+        else:
+            status, took = future.result()
+        report.append({"query": label, "status": status, "ms": round(took * 1000, 1)})
+
+    warmed = sum(1 for item in report if item["status"] == "warmed")
+    logger.info(f"Analytics warm-up: {warmed}/{len(report)} queries cached")
+    for item in report:
+        logger.info(f"  {item['status']:<9} {item['ms']:>9.1f} ms  {item['query']}")
+    return report
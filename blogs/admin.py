@@ -1,4 +1,17 @@
 from django.contrib import admin
+
+from main.paginators import EstimatedCountPaginator
 from .models import Blog
 
-admin.site.register(Blog)
+
+class BlogAdmin(admin.ModelAdmin):
+    list_display = ('id', 'title', 'author', 'created_at')
+    list_select_related = ('author',)
+    list_filter = (('created_at', admin.DateFieldListFilter),)
+    raw_id_fields = ('author',)
+    ordering = ('-created_at', '-id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+admin.site.register(Blog, BlogAdmin)
@@ -1,14 +1,55 @@
-bind = 'unix:/var/www/ideeza/app.sock'
-workers = 1
+import multiprocessing
+import os
+import threading
+
+bind = os.environ.get('GUNICORN_BIND', 'unix:/var/www/ideeza/app.sock')
+# gthread: every worker serves GUNICORN_THREADS requests at once, so one slow aggregation no longer blocks a whole
+# worker. Size the DB pool (DB_POOL_SIZE, defaults to GUNICORN_THREADS) and Postgres max_connections accordingly:
+# up to workers * threads connections per database.
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
 # worker_class = "uvicorn.workers.UvicornWorker"
 preload_app = True
 
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))  # recycle workers to bound memory growth
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100))  # so they don't all restart at once
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))  # a worker silent for longer is killed and restarted
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
 accesslog = '-'   # log access logs to stdout
 errorlog = '-'    # log error logs to stderr
 
+# Analytics cache warm-up
+#   ready  - warm in the master before the workers are forked, the (locmem) cache is inherited by every worker
+#   worker - warm in a background thread of each worker after it boots, use this with a per-process cache and preload_app off
+#   off    - disabled
+ANALYTICS_WARMUP = os.environ.get('ANALYTICS_WARMUP', 'ready')
+ANALYTICS_WARMUP_BUDGET = float(os.environ.get('ANALYTICS_WARMUP_BUDGET', 10))  # max seconds readiness may be delayed
+ANALYTICS_WARMUP_THREADS = int(os.environ.get('ANALYTICS_WARMUP_THREADS', 4))
+ANALYTICS_WARMUP_GRACE = float(os.environ.get('ANALYTICS_WARMUP_GRACE', 5))  # wait for the interrupted queries to return
+
+
+def warm_analytics_cache():
+    from analytics.warmup import warm_up
+    warm_up(budget=ANALYTICS_WARMUP_BUDGET, threads=ANALYTICS_WARMUP_THREADS, grace=ANALYTICS_WARMUP_GRACE)
+
+
+def close_db_connections():
+    # Connections and pools opened in the master (preload_app, warm-up) must not be shared with the forked workers
+    from django.db import connections
+    for conn in connections.all():
+        conn.close()
+        if conn.settings_dict.get('OPTIONS', {}).get('pool'):
+            conn.close_pool()
+
 
 def when_ready(server):
     print('---------- READY -----------------')
+    if ANALYTICS_WARMUP == 'ready':
+        warm_analytics_cache()
+        close_db_connections()
     open('/tmp/app-initialized', 'w').close()
 
 
@@ -19,3 +60,5 @@ def post_fork(server, worker):
 
 def post_worker_init(worker):
     print('---------- POST WORKER INIT -----------------')
+    if ANALYTICS_WARMUP == 'worker':
+        threading.Thread(target=warm_analytics_cache, name='analytics-warmup', daemon=True).start()
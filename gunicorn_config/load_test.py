@@ -0,0 +1,140 @@
+"""
+Throughput of the analytics API under different gunicorn settings.
+
+Starts gunicorn (gunicorn_config/gunicorn.conf.py) on a local port once per setting, runs the same request mix
+against it for a fixed time and prints requests/s and latency percentiles. The mix has cached dashboard requests and
+a share of uncached aggregations, which is what makes a sync worker stall. Run it from the project root with the
+usual environment (DATABASE_URL, SECRET_KEY, DJANGO_SETTINGS_MODULE...):
+
+    python gunicorn_config/load_test.py --duration 20 --concurrency 16 --settings sync:4 gthread:2x4 gthread:4x4
+
+A setting is <worker class>:<workers>[x<threads>]. Throttling is disabled and the warm-up skipped for the servers
+it starts. Errors include connections dropped while a worker is recycled by max_requests.
+"""
+import argparse
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+import requests
+
+CACHED_URLS = [
+    "/analytics/blog-views/?object_type=user",
+    "/analytics/blog-views/?object_type=country&range=month",
+    "/analytics/top/?top=blog",
+    "/analytics/top/?top=country&range=week",
+    "/analytics/performance/?compare=month",
+    "/analytics/live/",
+]
+# computed on every request: the date window is part of the cache key and is picked at random, to the second
+UNCACHED_URLS = [
+    "/analytics/blog-views/?object_type=country&start_date={start}&end_date={end}",
+    "/analytics/cube/?dimensions=country,user,period&start_date={start}&end_date={end}",
+    "/analytics/top/?top=blog&per=country&n=5&start_date={start}&end_date={end}",
+]
+
+
+def random_window():
+    end = datetime.now() - timedelta(seconds=random.randrange(30 * 86400))
+    start = end - timedelta(seconds=random.randrange(30 * 86400, 365 * 86400))
+    return {"start": start.isoformat(timespec="seconds"), "end": end.isoformat(timespec="seconds")}
+
+
+def parse_setting(value):
+    worker_class, _, size = value.partition(":")
+    workers, _, threads = size.partition("x")
+    return worker_class, int(workers or 1), int(threads or 1)
+
+
+def start_server(worker_class, workers, threads, port):
+    env = {
+        **os.environ,
+        "GUNICORN_WORKER_CLASS": worker_class,
+        "GUNICORN_WORKERS": str(workers),
+        "GUNICORN_THREADS": str(threads),
+        "ANALYTICS_WARMUP": "off",
+        "API_THROTTLE_ANON_RATE": "1000000/s",
+        "API_THROTTLE_USER_RATE": "1000000/s",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn_config/gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+         "--access-logfile", "/dev/null", "main.wsgi:application"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/analytics/live/", timeout=1)
+            return server
+        except requests.RequestException:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"gunicorn didn't start on port {port}")
+
+
+def run_load(base_url, duration, concurrency, uncached_ratio):
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            if random.random() < uncached_ratio:
+                url = random.choice(UNCACHED_URLS).format(**random_window())
+            else:
+                url = random.choice(CACHED_URLS)
+            started = time.perf_counter()
+            try:
+                ok = session.get(base_url + url, timeout=60).status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                (latencies if ok else errors).append(elapsed)
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--settings", nargs="+", default=["sync:2", "gthread:2x4", "gthread:2x8"])
+    parser.add_argument("--duration", type=float, default=15, help="Seconds of load per setting")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--uncached-ratio", type=float, default=0.1, help="Share of requests that bypass the cache")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    print(f"{'setting':<16} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for setting in args.settings:
+        worker_class, workers, threads = parse_setting(setting)
+        server = start_server(worker_class, workers, threads, args.port)
+        try:
+            latencies, errors = run_load(f"http://127.0.0.1:{args.port}", args.duration, args.concurrency, args.uncached_ratio)
+        finally:
+            server.terminate()
+            server.wait()
+
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100)
+            p50, p95, p99 = (cuts[i - 1] * 1000 for i in (50, 95, 99))
+        else:
+            p50 = p95 = p99 = float("nan")
+        print(
+            f"{setting:<16} {len(latencies):>9} {len(latencies) / args.duration:>8.1f} "
+            f"{p50:>8.1f} {p95:>8.1f} {p99:>8.1f} {len(errors):>7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
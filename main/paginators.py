@@ -0,0 +1,32 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    # The admin changelist counts its rows on every page load, a full COUNT(*) of a big table (BlogView, Blog) is slow.
+    # On Postgres the planner's row estimate is used instead (pg_class.reltuples when unfiltered, the EXPLAIN row
+    # estimate of the filtered query otherwise), an exact count is only run when the estimate is small.
+    exact_below = 100_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == "postgresql":
+            estimate = self.estimated_count(queryset, connection)
+            if estimate is not None and estimate >= self.exact_below:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def estimated_count(queryset, connection):
+        with connection.cursor() as cursor:
+            if not queryset.query.where:
+                cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = %s", [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+                return row[0] if row and row[0] >= 0 else None  # -1 until the table is first analyzed
+            sql, params = queryset.query.sql_with_params()
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+            return int(plan[0]["Plan"]["Plan Rows"])
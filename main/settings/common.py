@@ -62,7 +62,12 @@ ASGI_APPLICATION = 'main.asgi.application'
 CACHES = {
     "default": {
         "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
-    }
+    },
+    # Snapshots of the live counters, read by every worker: the per-process default would only show a worker its own
+    "live": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.environ.get('ANALYTICS_LIVE_CACHE_DIR', '/tmp/analytics-live'),
+    },
 }
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -128,6 +133,10 @@ LOGGING = {
             "class": "logging.StreamHandler",
             "formatter": "django.server",
         },
+        "analytics": {
+            "level": "INFO",
+            "class": "logging.StreamHandler",
+        },
         'file': {
             'level': 'ERROR',
             'class': 'logging.FileHandler',
@@ -151,9 +160,32 @@ LOGGING = {
             "level": "INFO",
             "propagate": False,
         },
+        # the warm-up report, written to stderr in production too
+        "analytics": {
+            "handlers": ["analytics", "file"],
+            "level": "INFO",
+            "propagate": False,
+        },
     },
 }
 
+DATABASE_ROUTERS = ['analytics.sharding.ShardRouter']
+
+# Optional psycopg 3 connection pool per process (Postgres only). Sized to the gunicorn threads of a worker, so each
+# request thread can get a connection without every worker holding persistent ones it doesn't use.
+DB_POOL = os.environ.get('DB_POOL', 'false').lower() == 'true'
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', os.environ.get('GUNICORN_THREADS', 4)))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))  # seconds a request waits for a free connection
+
+
+def pooled_database(config):
+    # dj_database_url config with the connection pool when DB_POOL is enabled
+    if DB_POOL and config.get('ENGINE') == 'django.db.backends.postgresql':
+        config['CONN_MAX_AGE'] = 0  # connections go back to the pool at the end of each request
+        config.setdefault('OPTIONS', {})['pool'] = {'min_size': 1, 'max_size': DB_POOL_SIZE, 'timeout': DB_POOL_TIMEOUT}
+    return config
+
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'users.User'
 
@@ -162,7 +194,8 @@ REST_FRAMEWORK = {
         'rest_framework.parsers.JSONParser'
     ],
     'DEFAULT_RENDERER_CLASSES': (
-        'rest_framework.renderers.JSONRenderer',
+        'analytics.renderers.ORJSONRenderer',
+        'analytics.renderers.ColumnarRenderer',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
@@ -177,11 +210,35 @@ REST_FRAMEWORK = {
         'rest_framework.throttling.AnonRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
-        'user': '30/m',
-        'anon': '20/m',
+        'user': os.environ.get('API_THROTTLE_USER_RATE', '30/m'),
+        'anon': os.environ.get('API_THROTTLE_ANON_RATE', '20/m'),
     }
 }
 
 CORS_ALLOW_CREDENTIALS = True  # If you need to send cookies
 CSRF_COOKIE_HTTPONLY = False  # JS must access it
 CSRF_COOKIE_NAME = 'csrftoken'
+
+# Analytics
+ANALYTICS_CACHE_TIMEOUT = int(os.environ.get('ANALYTICS_CACHE_TIMEOUT', 300))  # seconds a computed analytics response stays cached
+ANALYTICS_LIVE_WINDOW = int(os.environ.get('ANALYTICS_LIVE_WINDOW', 60))  # minutes kept by the live view counters
+ANALYTICS_LIVE_PUBLISH_INTERVAL = int(os.environ.get('ANALYTICS_LIVE_PUBLISH_INTERVAL', 5))  # seconds between a worker's snapshots
+ANALYTICS_DEDUP_ENABLED = os.environ.get('ANALYTICS_DEDUP_ENABLED', 'false').lower() == 'true'  # drop repeat views of a blog from the same IP
+ANALYTICS_DEDUP_WINDOW = int(os.environ.get('ANALYTICS_DEDUP_WINDOW', 60))  # seconds
+ANALYTICS_DEDUP_CAPACITY = int(os.environ.get('ANALYTICS_DEDUP_CAPACITY', 100_000))  # distinct (blog, ip) pairs expected per window
+ANALYTICS_DEDUP_ERROR_RATE = float(os.environ.get('ANALYTICS_DEDUP_ERROR_RATE', 0.001))  # false positive rate, i.e. genuine views dropped
+ANALYTICS_JOB_TIME_BUDGET = int(os.environ.get('ANALYTICS_JOB_TIME_BUDGET', 600))  # seconds a background analytics job may run
+ANALYTICS_JOB_TTL = int(os.environ.get('ANALYTICS_JOB_TTL', 3600))  # seconds a background job result is kept
+ANALYTICS_GEOIP_CSV = os.environ.get('ANALYTICS_GEOIP_CSV')  # start,end,country CSV of IP ranges for BlogView.viewer_country
+ANALYTICS_TRENDING_CACHE_TIMEOUT = int(os.environ.get('ANALYTICS_TRENDING_CACHE_TIMEOUT', 3600))  # seconds a trending count matrix is kept, it also rolls over with every new period
+ANALYTICS_TIME_BUDGET = float(os.environ.get('ANALYTICS_TIME_BUDGET', 10))  # seconds an analytics request may spend on the database, 0 = no limit
+ANALYTICS_TIME_BUDGETS = {  # per endpoint overrides, e.g. "blog-views=5,cube=30"
+    name.strip(): float(seconds)
+    for name, _, seconds in (item.partition('=') for item in os.environ.get('ANALYTICS_TIME_BUDGETS', '').split(',') if item.strip())
+}
+ANALYTICS_STALE_TIMEOUT = int(os.environ.get('ANALYTICS_STALE_TIMEOUT', 86400))  # seconds the last exact response is kept for requests that run out of time
+ANALYTICS_APPROXIMATE_SAMPLE = int(os.environ.get('ANALYTICS_APPROXIMATE_SAMPLE', 10))  # approximate responses count views in 1 of every N slices of the window
+ANALYTICS_COLUMNAR = os.environ.get('ANALYTICS_COLUMNAR', 'false').lower() == 'true'  # answer blog-views/top/performance from in-memory NumPy columns of the views
+ANALYTICS_COLUMNAR_REFRESH = float(os.environ.get('ANALYTICS_COLUMNAR_REFRESH', 5))  # seconds between reads of the new views
+ANALYTICS_COLUMNAR_RELOAD = int(os.environ.get('ANALYTICS_COLUMNAR_RELOAD', 3600))  # seconds between full reloads, which pick up renamed users and moved authors
+ANALYTICS_COMPACT_VIEWS = os.environ.get('ANALYTICS_COMPACT_VIEWS', 'false').lower() == 'true'  # BlogView is in the compact layout of migrate_blog_view_layout (binary IPs)
@@ -13,9 +13,15 @@ SECRET_KEY = os.environ['SECRET_KEY']
 ALLOWED_HOSTS = ['*']
 
 DATABASES = {
-    'default': dj_database_url.config(conn_max_age=600)
+    'default': pooled_database(dj_database_url.config(conn_max_age=600))
 }
 
+# Optional BlogView shards, one database per url, e.g. ANALYTICS_SHARD_URLS=sqlite:///shard0.sqlite3,sqlite:///shard1.sqlite3
+ANALYTICS_SHARDS = []
+for index, url in enumerate(filter(None, os.environ.get('ANALYTICS_SHARD_URLS', '').split(','))):
+    DATABASES[f'shard_{index}'] = pooled_database(dj_database_url.parse(url, conn_max_age=600))
+    ANALYTICS_SHARDS.append(f'shard_{index}')
+
 CSRF_TRUSTED_ORIGINS = [
     'http://localhost',
     'http://localhost:8000'
@@ -8,9 +8,15 @@ SECRET_KEY = os.environ['SECRET_KEY']
 ALLOWED_HOSTS = [os.environ['MAIN_ALLOWED_HOST']]
 
 DATABASES = {
-    'default': dj_database_url.config(conn_max_age=600, ssl_require=True)
+    'default': pooled_database(dj_database_url.config(conn_max_age=600, ssl_require=True))
 }
 
+# Optional BlogView shards, one database per url, e.g. ANALYTICS_SHARD_URLS=sqlite:///shard0.sqlite3,sqlite:///shard1.sqlite3
+ANALYTICS_SHARDS = []
+for index, url in enumerate(filter(None, os.environ.get('ANALYTICS_SHARD_URLS', '').split(','))):
+    DATABASES[f'shard_{index}'] = pooled_database(dj_database_url.parse(url, conn_max_age=600, ssl_require=True))
+    ANALYTICS_SHARDS.append(f'shard_{index}')
+
 RATELIMIT_IP_META_KEY = 'HTTP_X_REAL_IP'
 
 CSRF_TRUSTED_ORIGINS = [